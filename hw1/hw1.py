@@ -7,279 +7,749 @@ import ssl
 # End of Allowed Modules
 # Adding any extra module will result into score of 0
 
-def retrieve_url(url):
-  
-    TIMEOUT = 15
-    MAX_REDIRECTS = 10
+TIMEOUT = 15
+MAX_REDIRECTS = 10
+MAX_IDLE_PER_HOST = 4
+RECV_SIZE = 65536
+PIPELINE_DEPTH = 8
+MAX_HEAD_SIZE = 65536
+# Largest decoded body accepted, a guard against decompression bombs; None for no limit
+MAX_DECODED_SIZE = 256 * 1024 * 1024
+# Let a strong ETag prove a dynamic-looking page is stable with a 304
+CONDITIONAL_VERIFY = True
+# Optional resolver shared across calls (see hw1_dns.Resolver); None asks the system resolver every time
+RESOLVER = None
+# Optional timer (e.g. time.perf_counter) used to time TLS handshakes
+CLOCK = None
+
+# One TLS context for the whole process, built on first use
+SSL_CONTEXT = None
+# Last TLS session seen per (host, port) as (context, session), offered for
+# resumption on the next connect made with the same context
+TLS_SESSIONS = {}
+TLS_STATS = {"full": 0, "resumed": 0, "full_time": 0.0, "resumed_time": 0.0}
+
+
+def default_port(scheme):
+    return 443 if scheme == "https" else 80
+
+def idna(host):
+    # Convert Unicode hostname to ASCII (punycode)
+    try:
+        return host.encode("idna").decode("ascii")
+    except Exception:
+        return None
 
-    def default_port(scheme):
-        return 443 if scheme == "https" else 80
+def accept_encoding():
+    # Accept-Encoding value listing every content coding in DECODERS
+    names = [name for name in DECODERS if not name.startswith("x-")]
+    return ", ".join(names) if names else "identity"
+
+def simple_GET(host_ascii, port, path, scheme, extra_headers=None):
+    # Build a minimal, deterministic HTTP/1.1 GET request, with optional extra header lines.
+    # An Accept-Encoding in extra_headers replaces the default one.
+    host_hdr = host_ascii if port == default_port(scheme) else f"{host_ascii}:{port}"
+    lines = [
+        f"GET {path} HTTP/1.1",
+        f"Host: {host_hdr}",
+        "Connection: keep-alive",
+        "User-Agent: None",
+        "Accept: */*",
+        "Accept-Language: en",
+    ]
+    if not extra_headers or not any(k.lower() == "accept-encoding" for k in extra_headers):
+        lines.append(f"Accept-Encoding: {accept_encoding()}")
+    if extra_headers:
+        lines += [f"{k}: {v}" for k, v in extra_headers.items()]
+    lines += ["", ""]  # end headers
+    try:
+        return "\r\n".join(lines).encode("ascii", "strict")
+    except UnicodeEncodeError:
+        return None
 
-    def idna(host):
-        # Convert Unicode hostname to ASCII (punycode)
+def open_socket(scheme, host_ascii, port):
+    # Open TCP
+    s = open_tcp(host_ascii, port)
+    if scheme == "https":
         try:
-            return host.encode("idna").decode("ascii")
-        except Exception:
+            s = wrap_tls(s, host_ascii, port)
+        except ValueError:
+            # The context refused the cached session, which wrap_tls has
+            # dropped; the failed handshake closed the socket, so reconnect
+            s = wrap_tls(open_tcp(host_ascii, port), host_ascii, port)
+    return s
+
+def open_tcp(host_ascii, port):
+    if RESOLVER is not None:
+        return RESOLVER.connect(host_ascii, port, timeout=TIMEOUT)
+    return socket.create_connection((host_ascii, port), timeout=TIMEOUT)
+
+def tls_context():
+    # Return the shared TLS context so the CA store is only loaded once
+    global SSL_CONTEXT
+    if SSL_CONTEXT is None:
+        SSL_CONTEXT = ssl.create_default_context()
+    return SSL_CONTEXT
+
+def wrap_tls(sock, host_ascii, port):
+    # TLS handshake offering the host's cached session, counted in TLS_STATS.
+    # sock is closed if the handshake fails.
+    start = CLOCK() if CLOCK else 0.0
+    context = tls_context()
+    cached = TLS_SESSIONS.get((host_ascii, port))
+    # A session made by a context that has since been replaced cannot be offered
+    session = cached[1] if cached is not None and cached[0] is context else None
+    try:
+        s = context.wrap_socket(sock, server_hostname=host_ascii,  # SNI for HTTPS
+                                session=session)
+    except BaseException as exc:
+        sock.close()
+        if isinstance(exc, ValueError):
+            TLS_SESSIONS.pop((host_ascii, port), None)
+        raise
+    elapsed = CLOCK() - start if CLOCK else 0.0
+    kind = "resumed" if s.session_reused else "full"
+    TLS_STATS[kind] += 1
+    TLS_STATS[kind + "_time"] += elapsed
+    return s
+
+def save_tls_session(sock, host_ascii, port):
+    # Remember a connection's session. TLS 1.3 tickets arrive after the
+    # handshake, so this runs when the connection is released or closed.
+    if isinstance(sock, ssl.SSLSocket) and sock.session is not None:
+        TLS_SESSIONS[(host_ascii, port)] = (sock.context, sock.session)
+
+def partition_response(raw_response):
+    # Split raw HTTP response bytes into (header_block, body) or (None, None)
+    sep = b"\r\n\r\n"
+    i = raw_response.find(sep)
+    if i == -1:
+        return None, None
+    return raw_response[:i], raw_response[i + 4:]
+
+def parse_headers(header_block):
+    # Return (status_code, headers_dict) from a header block
+    text = header_block.decode("iso-8859-1", "replace")
+    lines = text.split("\r\n")
+    # First line is status line
+    if not lines or not lines[0].startswith("HTTP/"):
+        return None, {}
+    parts = lines[0].split(" ", 2)
+    try:
+        code = int(parts[1])
+    except Exception:
+        code = None
+    hdrs = {}
+    # Parse headers
+    for ln in lines[1:]:
+        if not ln:
+            continue
+        kv = ln.split(":", 1)
+        if len(kv) != 2:
+            continue
+        k = kv[0].strip().lower()
+        v = kv[1].strip()
+        hdrs[k] = v
+    return code, hdrs
+
+def decode_chunked(body_bytes):
+    # Decode Transfer-Encoding: chunked payload
+    pos = 0
+    out = bytearray()
+    total_len = len(body_bytes)
+    #Loop over chunks
+    while True:
+        j = body_bytes.find(b"\r\n", pos)
+        if j == -1:
             return None
-
-    def simple_GET(host_ascii, port, path, scheme):
-        # Build a minimal, deterministic HTTP/1.1 GET request
-        host_hdr = host_ascii if port == default_port(scheme) else f"{host_ascii}:{port}"
-        lines = [
-            f"GET {path} HTTP/1.1",
-            f"Host: {host_hdr}",
-            "Connection: close",
-            "User-Agent: None",
-            "Accept: */*",
-            "Accept-Language: en",
-            "Accept-Encoding: identity",
-            "",  # end headers
-            "",
-        ]
+        # Parse chunk size line
+        size_line = body_bytes[pos:j].decode("ascii", "replace").strip()
+        semi = size_line.find(";")
+        size_str = size_line[:semi] if semi != -1 else size_line
         try:
-            return "\r\n".join(lines).encode("ascii", "strict")
-        except UnicodeEncodeError:
+            size = int(size_str, 16)
+        except ValueError:
             return None
-
-    def open_socket(scheme, host_ascii, port):
-        # Open TCP
-        s = socket.create_connection((host_ascii, port), timeout=TIMEOUT)
-        if scheme == "https":
-            ssl_context = ssl.create_default_context() 
-            s = ssl_context.wrap_socket(s, server_hostname=host_ascii)  # SNI for HTTPS
-        return s
-
-    def partition_response(raw_response):
-        # Split raw HTTP response bytes into (header_block, body) or (None, None)
-        sep = b"\r\n\r\n"
-        i = raw_response.find(sep)
-        if i == -1:
-            return None, None
-        return raw_response[:i], raw_response[i + 4:]
-
-    def parse_headers(header_block):
-        # Return (status_code, headers_dict) from a header block
-        text = header_block.decode("iso-8859-1", "replace")
-        lines = text.split("\r\n")
-        # First line is status line
-        if not lines or not lines[0].startswith("HTTP/"):
-            return None, {}
-        parts = lines[0].split(" ", 2)
-        try:
-            code = int(parts[1])
-        except Exception:
-            code = None
-        hdrs = {}
-        # Parse headers
-        for ln in lines[1:]:
-            if not ln:
-                continue
-            kv = ln.split(":", 1)
-            if len(kv) != 2:
-                continue
-            k = kv[0].strip().lower()
-            v = kv[1].strip()
-            hdrs[k] = v
-        return code, hdrs
-
-    def decode_chunked(body_bytes):
-        # Decode Transfer-Encoding: chunked payload
-        pos = 0
-        out = bytearray()
-        total_len = len(body_bytes)
-        #Loop over chunks
-        while True:
-            j = body_bytes.find(b"\r\n", pos)
-            if j == -1:
-                return None
-            # Parse chunk size line
-            size_line = body_bytes[pos:j].decode("ascii", "replace").strip()
-            semi = size_line.find(";")
-            size_str = size_line[:semi] if semi != -1 else size_line
-            try:
-                size = int(size_str, 16)
-            except ValueError:
-                return None
-            pos = j + 2
-            if size == 0:
-                return bytes(out)  # Ignore trailers
-            if pos + size > total_len:
-                return None
-            out += body_bytes[pos:pos + size]
-            pos += size
-            if body_bytes[pos:pos + 2] != b"\r\n":
-                return None
-            pos += 2
-
-    def reparse_url(full_url):
-        # Reparse an absolute URL into (scheme, host, port, path)
-        #HTTP
-        if full_url.startswith("http://"):
-            rest = full_url[7:]
-            scheme = "http"
-            port = 80
-        #HTTPS
-        elif full_url.startswith("https://"):
-            rest = full_url[8:]
-            scheme = "https"
-            port = 443
-        else:
+        pos = j + 2
+        if size == 0:
+            return bytes(out)  # Ignore trailers
+        if pos + size > total_len:
             return None
-        # Find host, port, path
-        slash_idx = rest.find("/")
-        if slash_idx == -1:
-            hostport = rest
-            path = "/"
-        else:
-            hostport = rest[:slash_idx]
-            path = rest[slash_idx:] or "/"
-        if not hostport:
+        out += body_bytes[pos:pos + size]
+        pos += size
+        if body_bytes[pos:pos + 2] != b"\r\n":
             return None
+        pos += 2
 
-        if ":" in hostport:
-            host, port_str = hostport.rsplit(":", 1)
-            try:
-                port = int(port_str)
-            except ValueError:
-                return None
-        else:
-            host = hostport
-        return scheme, host, port, path
-
-    def resolve_redirect(cur_scheme, cur_host, cur_port, cur_path, location):
-        # Resolve a Location header into an absolute URL string
-        if location.startswith("http://") or location.startswith("https://"):
-            return location
-        # Protocol
-        if location.startswith("//"):
-            return f"{cur_scheme}:{location}"
-        # Absolute path
-        if location.startswith("/"):
-            if (cur_scheme == "http" and cur_port == 80) or (cur_scheme == "https" and cur_port == 443):
-                return f"{cur_scheme}://{cur_host}{location}"
-            else:
-                return f"{cur_scheme}://{cur_host}:{cur_port}{location}"
-        # Relative path
-        base_dir_end = cur_path.rfind("/")
-        base_dir = cur_path[:base_dir_end + 1] if base_dir_end != -1 else "/"
-        joined = base_dir + location
+def reparse_url(full_url):
+    # Reparse an absolute URL into (scheme, host, port, path)
+    #HTTP
+    if full_url.startswith("http://"):
+        rest = full_url[7:]
+        scheme = "http"
+        port = 80
+    #HTTPS
+    elif full_url.startswith("https://"):
+        rest = full_url[8:]
+        scheme = "https"
+        port = 443
+    else:
+        return None
+    # Find host, port, path
+    slash_idx = rest.find("/")
+    if slash_idx == -1:
+        hostport = rest
+        path = "/"
+    else:
+        hostport = rest[:slash_idx]
+        path = rest[slash_idx:] or "/"
+    if not hostport:
+        return None
+
+    if ":" in hostport:
+        host, port_str = hostport.rsplit(":", 1)
+        try:
+            port = int(port_str)
+        except ValueError:
+            return None
+    else:
+        host = hostport
+    return scheme, host, port, path
+
+def resolve_redirect(cur_scheme, cur_host, cur_port, cur_path, location):
+    # Resolve a Location header into an absolute URL string
+    if location.startswith("http://") or location.startswith("https://"):
+        return location
+    # Protocol
+    if location.startswith("//"):
+        return f"{cur_scheme}:{location}"
+    # Absolute path
+    if location.startswith("/"):
         if (cur_scheme == "http" and cur_port == 80) or (cur_scheme == "https" and cur_port == 443):
-            return f"{cur_scheme}://{cur_host}{joined}"
+            return f"{cur_scheme}://{cur_host}{location}"
         else:
-            return f"{cur_scheme}://{cur_host}:{cur_port}{joined}"
-
-    def check_dynamic(headers):
-        # Check headers for signs of dynamic content
-        cc = headers.get("cache-control", "").lower()
-        pragma = headers.get("pragma", "").lower()
-        vary = headers.get("vary", "").strip()
-        # Check for cookies or no cache 
-        if "set-cookie" in headers:
-            return True
-        # Check cache-control, pragma and vary in the headers
-        if "no-store" in cc or "no-cache" in cc or "max-age=0" in cc or "private" in cc:
-            return True
-        if "no-cache" in pragma:
-            return True
-        if vary == "*":
-            return True
-        return False
+            return f"{cur_scheme}://{cur_host}:{cur_port}{location}"
+    # Relative path
+    base_dir_end = cur_path.rfind("/")
+    base_dir = cur_path[:base_dir_end + 1] if base_dir_end != -1 else "/"
+    joined = base_dir + location
+    if (cur_scheme == "http" and cur_port == 80) or (cur_scheme == "https" and cur_port == 443):
+        return f"{cur_scheme}://{cur_host}{joined}"
+    else:
+        return f"{cur_scheme}://{cur_host}:{cur_port}{joined}"
+
+def check_dynamic(headers):
+    # Check headers for signs of dynamic content
+    cc = headers.get("cache-control", "").lower()
+    pragma = headers.get("pragma", "").lower()
+    vary = headers.get("vary", "").strip()
+    # Check for cookies or no cache
+    if "set-cookie" in headers:
+        return True
+    # Check cache-control, pragma and vary in the headers
+    if "no-store" in cc or "no-cache" in cc or "max-age=0" in cc or "private" in cc:
+        return True
+    if "no-cache" in pragma:
+        return True
+    if vary == "*":
+        return True
+    return False
+
+
+class SocketReader:
+    """
+    Buffered reader over one socket, built on a single reusable bytearray
+    filled with recv_into. Headers and chunk framing are sliced out of it
+    through a memoryview, and bytes received past the end of a response stay
+    buffered so the socket can carry the next response.
+    """
+
+    def __init__(self, sock, size=RECV_SIZE, key=None):
+        self.sock = sock
+        self.key = key
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+
+    def buffered(self):
+        return self.end - self.start
+
+    def fill(self):
+        # Receive more bytes after the buffered ones, False on EOF
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buf):
+            n = self.end - self.start
+            if self.start:
+                # Move the unread tail to the front
+                self.view[:n] = self.view[self.start:self.end]
+            else:
+                # A single header block larger than the buffer: grow it
+                self.view.release()
+                self.buf.extend(bytes(len(self.buf)))
+                self.view = memoryview(self.buf)
+            self.start, self.end = 0, n
+        got = self.sock.recv_into(self.view[self.end:])
+        if not got:
+            return False
+        self.end += got
+        return True
+
+    def read_until(self, sep, limit=None):
+        # Return bytes up to and including sep, or None on EOF.
+        # Raises ValueError if more than limit bytes come before the end of sep.
+        search = self.start
+        while True:
+            i = self.buf.find(sep, search, self.end)
+            if i != -1:
+                stop = i + len(sep)
+                if limit is not None and stop - self.start > limit:
+                    raise ValueError("response head too large")
+                out = bytes(self.view[self.start:stop])
+                self.start = stop
+                return out
+            if limit is not None and self.end - self.start > limit:
+                raise ValueError("response head too large")
+            # Only rescan the bytes that could still start sep
+            skip = max(0, self.end - self.start - len(sep) + 1)
+            if not self.fill():
+                return None
+            search = self.start + skip
 
-    def full_URL_check(start_scheme, start_host, start_port, start_path):
-        # Uses all helper function to open socket, send request, read close, skip 1xx,
-        # handle redirects, decode body, return (final_url_tuple, body_bytes, headers_dict) or (None, None, None)
-        cur_scheme, cur_host, cur_port, cur_path = start_scheme, start_host, start_port, start_path
+    def read_exact(self, n):
+        # Return exactly n bytes, or None on EOF
+        while self.end - self.start < n:
+            if not self.fill():
+                return None
+        out = bytes(self.view[self.start:self.start + n])
+        self.start += n
+        return out
+
+    def readinto_exact(self, target):
+        # Fill the writable memoryview target, receiving straight into it once the buffer is drained
+        have = min(len(target), self.end - self.start)
+        target[:have] = self.view[self.start:self.start + have]
+        self.start += have
+        pos = have
+        while pos < len(target):
+            got = self.sock.recv_into(target[pos:])
+            if not got:
+                raise ConnectionError("connection closed mid-body")
+            pos += got
+
+    def iter_exact(self, n):
+        # Yield exactly n bytes as they arrive
+        while n > 0:
+            if self.start == self.end and not self.fill():
+                raise ConnectionError("connection closed mid-body")
+            take = min(n, self.end - self.start)
+            yield bytes(self.view[self.start:self.start + take])
+            self.start += take
+            n -= take
+
+    def iter_to_close(self):
+        # Yield everything until the peer closes
+        while True:
+            if self.start != self.end:
+                yield bytes(self.view[self.start:self.end])
+                self.start = self.end
+            if not self.fill():
+                return
+
+    def read_chunk_size(self):
+        # Read one chunk-size line, ignoring extensions
+        size_line = self.read_until(b"\r\n")
+        if size_line is None:
+            raise ConnectionError("connection closed mid-body")
+        size_str = size_line[:-2].split(b";", 1)[0].strip()
+        try:
+            return int(size_str, 16)
+        except ValueError:
+            raise ValueError("bad chunk size") from None
 
-        for _ in range(MAX_REDIRECTS + 1):
-            host_ascii = idna(cur_host)
-            if not host_ascii:
-                return None, None, None
+    def read_chunk_end(self):
+        # Consume the CRLF after a chunk's data
+        if self.read_exact(2) != b"\r\n":
+            raise ValueError("missing CRLF after chunk")
 
-            req = simple_GET(host_ascii, cur_port, cur_path, cur_scheme)
-            if req is None:
-                return None, None, None
+    def read_trailers(self):
+        # Trailers end with an empty line
+        while True:
+            line = self.read_until(b"\r\n")
+            if line is None:
+                raise ConnectionError("connection closed in trailers")
+            if line == b"\r\n":
+                return
+
+    def iter_chunked(self):
+        # Yield the payload of a chunked body, consuming the trailers
+        while True:
+            size = self.read_chunk_size()
+            if size == 0:
+                break
+            yield from self.iter_exact(size)
+            self.read_chunk_end()
+        self.read_trailers()
 
-            sock = None
-            # Read response
+    def read_chunked(self):
+        # Return the whole payload of a chunked body, each byte copied once out of the buffer
+        out = bytearray()
+        while True:
+            size = self.read_chunk_size()
+            if size == 0:
+                break
+            while size > 0:
+                if self.start == self.end and not self.fill():
+                    raise ConnectionError("connection closed mid-body")
+                take = min(size, self.end - self.start)
+                out += self.view[self.start:self.start + take]
+                self.start += take
+                size -= take
+            self.read_chunk_end()
+        self.read_trailers()
+        return out
+
+    def close(self):
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+
+class StreamFile:
+    """
+    Minimal read-only file object over an iterator of bytes, so gzip.GzipFile
+    can decompress a body while it is still arriving.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.pending = b""
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            out = self.pending + b"".join(self.chunks)
+            self.pending = b""
+            return out
+        while not self.pending:
+            self.pending = next(self.chunks, None)
+            if self.pending is None:
+                self.pending = b""
+                return b""
+        out = self.pending[:size]
+        self.pending = self.pending[size:]
+        return out
+
+
+class ConnectionPool:
+    """
+    Idle keep-alive connections keyed by (scheme, host, port). A connection
+    is only returned to the pool once its last response was read to the end.
+    """
+
+    def __init__(self, max_idle=MAX_IDLE_PER_HOST):
+        self.max_idle = max_idle
+        self.idle = {}
+
+    def acquire(self, scheme, host_ascii, port, fresh=False):
+        # Return (reader, reused) for key, opening a new connection if none is
+        # idle or fresh is set
+        conns = None if fresh else self.idle.get((scheme, host_ascii, port))
+        if conns:
+            # Another thread may empty the list between the check and the pop
             try:
-                sock = open_socket(cur_scheme, host_ascii, cur_port)
-                sock.sendall(req)
-
-                chunks = []
-                while True:
-                    data = sock.recv(4096)
-                    if not data:
-                        break
-                    chunks.append(data)
-                if not chunks:
-                    return None, None, None
-                raw_response = b"".join(chunks)
-            except (socket.timeout, OSError, ssl.SSLError):
-                return None, None, None
-            finally:
-                if sock is not None:
-                    try:
-                        sock.close()
-                    except Exception:
-                        pass
-
-            # Skip 1xx responses
+                return conns.pop(), True
+            except IndexError:
+                pass
+        key = (scheme, host_ascii, port)
+        return SocketReader(open_socket(scheme, host_ascii, port), key=key), False
+
+    def release(self, scheme, host_ascii, port, reader):
+        # Park a reusable connection, closing it if the pool is full
+        conns = self.idle.setdefault((scheme, host_ascii, port), [])
+        if len(conns) >= self.max_idle or reader.buffered():
+            self.discard(reader)
+            return
+        save_tls_session(reader.sock, host_ascii, port)
+        conns.append(reader)
+
+    def discard(self, reader):
+        if reader.key is not None:
+            save_tls_session(reader.sock, *reader.key[1:])
+        reader.close()
+
+    def close_all(self):
+        for conns in self.idle.values():
+            for reader in conns:
+                self.discard(reader)
+        self.idle.clear()
+
+
+POOL = ConnectionPool()
+
+
+def read_head(reader):
+    # Read the status line and headers of one response, skipping 1xx.
+    # Return (code, headers_dict, reusable) or None
+    while True:
+        header_block = reader.read_until(b"\r\n\r\n", MAX_HEAD_SIZE)
+        if header_block is None:
+            return None
+        code, hdrs = parse_headers(header_block[:-4])
+        if code is None:
+            return None
+        if not 100 <= code < 200:
+            break
+
+    conn = hdrs.get("connection", "").lower()
+    reusable = "close" not in conn and header_block.startswith(b"HTTP/1.1")
+    # Without framing headers the body runs until the server closes
+    te = hdrs.get("transfer-encoding", "").lower()
+    if code not in (204, 304) and "chunked" not in te and "content-length" not in hdrs:
+        reusable = False
+    return code, hdrs, reusable
+
+def iter_body(reader, code, hdrs):
+    # Yield the body of a response with its transfer encoding removed
+    te = hdrs.get("transfer-encoding", "").lower()
+    if code in (204, 304):
+        return
+    if "chunked" in te:
+        yield from reader.iter_chunked()
+    elif "content-length" in hdrs:
+        try:
+            length = int(hdrs["content-length"])
+        except ValueError:
+            raise ValueError("bad content-length") from None
+        yield from reader.iter_exact(length)
+    else:
+        yield from reader.iter_to_close()
+
+def read_body(reader, code, hdrs):
+    # Return the whole body of a response with its transfer encoding removed.
+    # The body is a bytearray, each byte copied once: a Content-Length body is
+    # received straight into it, and converting it to bytes would copy it all again.
+    te = hdrs.get("transfer-encoding", "").lower()
+    if code in (204, 304):
+        return b""
+    if "chunked" in te:
+        return reader.read_chunked()
+    if "content-length" in hdrs:
+        try:
+            length = int(hdrs["content-length"])
+        except ValueError:
+            raise ValueError("bad content-length") from None
+        out = bytearray(length)
+        reader.readinto_exact(memoryview(out))
+        return out
+    out = bytearray()
+    for piece in reader.iter_to_close():
+        out += piece
+    return out
+
+def gunzip_chunks(chunks):
+    # Yield a gzip stream decompressed in windows of at most RECV_SIZE bytes
+    try:
+        with gzip.GzipFile(fileobj=StreamFile(chunks)) as gz:
             while True:
-                header_block, body = partition_response(raw_response)
-                if header_block is None:
-                    return None, None, None
-                code, hdrs = parse_headers(header_block)
-                if code is None:
-                    return None, None, None
-                if 100 <= code < 200:
-                    sep_idx = raw_response.find(b"\r\n\r\n")
-                    if sep_idx == -1:
-                        return None, None, None
-                    raw_response = raw_response[sep_idx + 4:]
-                    continue
+                data = gz.read(RECV_SIZE)
+                if not data:
+                    return
+                yield data
+    except (OSError, ValueError):
+        raise
+    except Exception as exc:
+        raise ValueError("bad gzip body") from exc
+
+# Content coding -> generator function taking and yielding chunks of bytes.
+# hw1_encodings.install() adds deflate and br.
+DECODERS = {"gzip": gunzip_chunks, "x-gzip": gunzip_chunks}
+
+def decode_content(chunks, hdrs):
+    # Yield body bytes with every content coding removed, the last one applied first.
+    # A body whose last coding is one we do not know (servers send things
+    # like "UTF-8" here) is passed on as it is. Raises ValueError for an
+    # unknown coding under known ones, which would leave the body half
+    # decoded, or a decoded body over MAX_DECODED_SIZE.
+    codings = [c.strip().lower() for c in hdrs.get("content-encoding", "").split(",")]
+    source = chunks
+    try:
+        decoders = []
+        for coding in reversed(codings):
+            if not coding or coding == "identity":
+                continue
+            decoder = DECODERS.get(coding)
+            if decoder is None:
+                if decoders:
+                    raise ValueError(f"unsupported content-encoding {coding!r}")
                 break
-
-            # Redirects
-            if 300 <= code <= 399:
-                loc = hdrs.get("location")
-                if not loc:
-                    return None, None, None
-                nxt = resolve_redirect(cur_scheme, cur_host, cur_port, cur_path, loc)
-                if not nxt:
-                    return None, None, None
-                parsed = reparse_url(nxt)
-                if not parsed:
-                    return None, None, None
-                cur_scheme, cur_host, cur_port, cur_path = parsed
+            decoders.append(decoder)
+        if not decoders:
+            yield from chunks
+            return
+        for decoder in decoders:
+            chunks = decoder(chunks)
+        total = 0
+        for data in chunks:
+            total += len(data)
+            if MAX_DECODED_SIZE is not None and total > MAX_DECODED_SIZE:
+                raise ValueError("decoded body exceeds MAX_DECODED_SIZE")
+            yield data
+    finally:
+        # Stop reading the raw body if decoding stopped early
+        close = getattr(source, "close", None)
+        if close is not None:
+            close()
+
+def decode_body(body, hdrs):
+    # Return a whole body with the content encoding removed
+    if not body or not hdrs.get("content-encoding"):
+        return body
+    return b"".join(decode_content(iter((body,)), hdrs))
+
+def send_request(scheme, host_ascii, port, req):
+    # Send req over a pooled connection and read the response head.
+    # Return (reader, code, headers_dict, reusable) or None.
+    # A reused connection may have been closed by the server while idle, so
+    # a failure on one is retried on a new connection; the other idle ones
+    # for the origin may be just as dead.
+    fresh = False
+    while True:
+        reader, reused = POOL.acquire(scheme, host_ascii, port, fresh)
+        try:
+            reader.sock.sendall(req)
+            head = read_head(reader)
+        except (socket.timeout, OSError, ssl.SSLError, ValueError):
+            head = None
+        if head is None:
+            POOL.discard(reader)
+            if reused:
+                fresh = True
                 continue
+            return None
+        return (reader,) + head
+
+class Body:
+    """
+    Body of one response, read either as a stream (iterate) or all at once
+    (read). Once it has been read to the end the connection goes back to the
+    pool; if it is abandoned, fails or is closed early the connection is
+    dropped.
+    """
+
+    def __init__(self, scheme, host_ascii, port, reader, code, hdrs, reusable):
+        self.key = (scheme, host_ascii, port)
+        self.reader = reader
+        self.code = code
+        self.hdrs = hdrs
+        self.reusable = reusable
+
+    def finish(self, complete):
+        if self.reader is None:
+            return
+        if complete and self.reusable:
+            POOL.release(*self.key, self.reader)
+        else:
+            POOL.discard(self.reader)
+        self.reader = None
 
-            # Only final 200 OK is acceptable
-            if code != 200:
-                return None, None, None
-
-            # Transfer/Content encodings
-            te = hdrs.get("transfer-encoding", "").lower()
-            ce = hdrs.get("content-encoding", "").lower()
-
-            if "chunked" in te:
-                decoded = decode_chunked(body)
-                if decoded is None:
-                    return None, None, None
-                body = decoded
-
-            if "gzip" in ce:
-                try:
-                    body = gzip.decompress(body)
-                except Exception:
-                    return None, None, None
-
-            # Success
-            return (cur_scheme, cur_host, cur_port, cur_path), body, hdrs
+    def close(self):
+        self.finish(False)
 
-        # Too many redirects
+    def raw_chunks(self):
+        # Yield the body with only its transfer encoding removed
+        complete = False
+        try:
+            yield from iter_body(self.reader, self.code, self.hdrs)
+            complete = True
+        finally:
+            self.finish(complete)
+
+    def __iter__(self):
+        # Yield the decoded body as it arrives
+        return decode_content(self.raw_chunks(), self.hdrs)
+
+    def read(self):
+        # Return the whole decoded body
+        complete = False
+        try:
+            body = read_body(self.reader, self.code, self.hdrs)
+            complete = True
+        finally:
+            self.finish(complete)
+        return decode_body(body, self.hdrs)
+
+def open_url(start_scheme, start_host, start_port, start_path, extra_headers=None):
+    # Uses all helper function to send request over a pooled connection, skip 1xx,
+    # handle redirects, return (final_url_tuple, code, headers_dict, Body) or (None, None, None, None).
+    # With extra_headers (a conditional or Range GET) a 304 Not Modified or
+    # 206 Partial Content is also returned.
+    cur_scheme, cur_host, cur_port, cur_path = start_scheme, start_host, start_port, start_path
+
+    for _ in range(MAX_REDIRECTS + 1):
+        host_ascii = idna(cur_host)
+        if not host_ascii:
+            return None, None, None, None
+
+        req = simple_GET(host_ascii, cur_port, cur_path, cur_scheme, extra_headers)
+        if req is None:
+            return None, None, None, None
+
+        # Read response head
+        try:
+            resp = send_request(cur_scheme, host_ascii, cur_port, req)
+        except (socket.timeout, OSError, ssl.SSLError, ValueError):
+            return None, None, None, None
+        if resp is None:
+            return None, None, None, None
+        reader, code, hdrs, reusable = resp
+        body = Body(cur_scheme, host_ascii, cur_port, reader, code, hdrs, reusable)
+
+        # Redirects
+        if 300 <= code <= 399 and code != 304:
+            # Drain the redirect body so the connection can be reused
+            try:
+                for _ in body.raw_chunks():
+                    pass
+            except (OSError, ValueError):
+                pass
+            loc = hdrs.get("location")
+            if not loc:
+                return None, None, None, None
+            nxt = resolve_redirect(cur_scheme, cur_host, cur_port, cur_path, loc)
+            if not nxt:
+                return None, None, None, None
+            parsed = reparse_url(nxt)
+            if not parsed:
+                return None, None, None, None
+            cur_scheme, cur_host, cur_port, cur_path = parsed
+            continue
+
+        # Only final 200 OK is acceptable, or 304/206 for conditional and Range requests
+        if code != 200 and not (code in (206, 304) and extra_headers):
+            body.close()
+            return None, None, None, None
+
+        # Success
+        return (cur_scheme, cur_host, cur_port, cur_path), code, hdrs, body
+
+    # Too many redirects
+    return None, None, None, None
+
+def full_URL_check(start_scheme, start_host, start_port, start_path):
+    # Fetch a URL into memory, return (final_url_tuple, body_bytes, headers_dict) or (None, None, None)
+    final, _, hdrs, body = open_url(start_scheme, start_host, start_port, start_path)
+    if final is None:
         return None, None, None
+    try:
+        body = body.read()
+    except (OSError, ValueError):
+        return None, None, None
+    return final, body, hdrs
 
-    # Initial parse (branching)
+def split_url(url):
+    # Initial parse (branching), return (scheme, host, port, path) or None
     if not isinstance(url, str):
         raise ValueError("URL must be a string")
     # HTTP
@@ -313,24 +783,181 @@ def retrieve_url(url):
             return None
     else:
         host = hostport
+    return scheme, host, port, path
+
+
+def iter_url(url):
+    # Stream the body of url, return an iterator of bytes or None if there is no 200 OK.
+    # Memory stays flat regardless of body size. The iterator raises OSError or
+    # ValueError if the body is cut short or malformed. Dynamic pages are not
+    # double-checked here since that would need the whole body.
+    parsed = split_url(url)
+    if parsed is None:
+        return None
+    final, _, _, body = open_url(*parsed)
+    if final is None:
+        return None
+    return iter(body)
+
+
+def revalidate(entry):
+    # Conditional GET for a stale cache entry, straight to its final URL.
+    # Return (final_url_tuple, code, body_bytes, headers_dict) or (None, None, None, None)
+    final, code, hdrs, body = open_url(*entry.final, extra_headers=entry.conditional_headers())
+    if final is None:
+        return None, None, None, None
+    try:
+        body = body.read()
+    except (OSError, ValueError):
+        return None, None, None, None
+    return final, code, body, hdrs
+
+
+def body_matches(body, expected):
+    # Compare a streamed Body against expected without holding a second copy,
+    # stopping at the first difference
+    view = memoryview(expected)
+    pos = 0
+    try:
+        for chunk in body:
+            end = pos + len(chunk)
+            if end > len(expected) or view[pos:end] != chunk:
+                body.close()
+                return False
+            pos = end
+    except (OSError, ValueError):
+        return False
+    return pos == len(expected)
+
+def verify_stable(final, body, hdrs):
+    # Check that a second fetch of final returns the same body.
+    # With a strong ETag the server can answer 304 and skip the transfer.
+    etag = hdrs.get("etag", "")
+    extra = None
+    if CONDITIONAL_VERIFY and etag and not etag.startswith("W/"):
+        extra = {"If-None-Match": etag}
+    final2, code, _, body2 = open_url(*final, extra_headers=extra)
+    if final2 is None:
+        return False
+    if code == 304:
+        body2.read()
+        return True
+    return body_matches(body2, body)
+
+
+def retrieve_url(url, cache=None):
+    # cache is optional (see hw1_cache.ResponseCache): fresh entries are served
+    # without touching the network and stale ones are revalidated with one request.
+    # The body is bytes-like: a bytearray unless a content coding was removed.
+    parsed = split_url(url)
+    if parsed is None:
+        return None
 
     # First fetch
-    final1, body1, hdrs1 = full_URL_check(scheme, host, port, path)
+    final1 = None
+    if cache is not None:
+        entry = cache.get(url)
+        if entry is not None:
+            if entry.is_fresh():
+                return entry.body
+            final1, code, body1, hdrs1 = revalidate(entry)
+            if code == 304:
+                cache.refresh(url, hdrs1)
+                return entry.body
+    if final1 is None:
+        final1, body1, hdrs1 = full_URL_check(*parsed)
     if final1 is None or body1 is None:
         return None
 
     # Only double-fetch if headers suggest content is likely dynamic
     if check_dynamic(hdrs1):
-        fs, fh, fp, fpath = final1
-        final2, body2, _ = full_URL_check(fs, fh, fp, fpath)
-        # Compare bodies
-        if final2 is None or body2 is None:
-            return None
-        if body1 != body2:
+        if not verify_stable(final1, body1, hdrs1):
             return None
+    elif cache is not None:
+        cache.put(url, final1, hdrs1, body1)
 
     return body1
 
 
+def pipeline_batch(scheme, host_ascii, port, reqs, fresh=False):
+    # Write reqs back to back on one connection (a new one if fresh) and read
+    # the responses in order. Return [(code, headers_dict, body_bytes)] for the
+    # responses that arrived before the server closed or broke framing; the
+    # caller resends the rest.
+    out = []
+    try:
+        reader, _ = POOL.acquire(scheme, host_ascii, port, fresh)
+    except (socket.timeout, OSError, ssl.SSLError, ValueError):
+        return out
+    reusable = True
+    try:
+        reader.sock.sendall(b"".join(reqs))
+        for _ in reqs:
+            head = read_head(reader)
+            if head is None:
+                break
+            code, hdrs, reusable = head
+            out.append((code, hdrs, read_body(reader, code, hdrs)))
+            if not reusable:
+                break
+    except (socket.timeout, OSError, ssl.SSLError, ValueError):
+        reusable = False
+    if reusable and len(out) == len(reqs):
+        POOL.release(scheme, host_ascii, port, reader)
+    else:
+        POOL.discard(reader)
+    return out
+
+def finish_pipelined(url, final, code, hdrs, body):
+    # Turn one pipelined response into what retrieve_url would return
+    if code != 200:
+        # Redirects take the regular path; anything else is a failure
+        return retrieve_url(url) if 300 <= code <= 399 else None
+    try:
+        body = decode_body(body, hdrs)
+    except ValueError:
+        return None
+    if check_dynamic(hdrs) and not verify_stable(final, body, hdrs):
+        return None
+    return body
+
+def retrieve_pipelined(urls, depth=PIPELINE_DEPTH):
+    # Fetch many URLs, pipelining up to depth GETs per connection for URLs that
+    # share an origin. Return a list of bodies (or None) in the order of urls.
+    results = [None] * len(urls)
+    origins = {}
+    for i, url in enumerate(urls):
+        parsed = split_url(url)
+        if parsed is None:
+            continue
+        scheme, host, port, path = parsed
+        host_ascii = idna(host)
+        req = simple_GET(host_ascii, port, path, scheme) if host_ascii else None
+        if req is None:
+            continue
+        origins.setdefault((scheme, host_ascii, port), []).append((i, (scheme, host, port, path), req))
+
+    for (scheme, host_ascii, port), todo in origins.items():
+        stalls = 0
+        while todo:
+            batch = todo[:depth]
+            # After an empty round, try again on a new connection
+            got = pipeline_batch(scheme, host_ascii, port, [req for _, _, req in batch], stalls > 0)
+            if not got:
+                # One empty round may just be a stale pooled connection
+                stalls += 1
+                if stalls < 2:
+                    continue
+                # The origin will not answer pipelined requests, fetch the rest one by one
+                for i, _, _ in todo:
+                    results[i] = retrieve_url(urls[i])
+                break
+            stalls = 0
+            for (i, final, _), (code, hdrs, body) in zip(batch, got):
+                results[i] = finish_pipelined(urls[i], final, code, hdrs, body)
+            todo = todo[len(got):]
+    return results
+
+
 if __name__ == "__main__":
     sys.stdout.buffer.write(retrieve_url(sys.argv[1]))
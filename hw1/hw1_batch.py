@@ -0,0 +1,230 @@
+"""
+Concurrent batch fetching for the hw1 client.
+
+hw1.py is limited to its allowed modules, so the asyncio engine lives here
+and reuses the request/response helpers from hw1. A slow host only holds up
+its own requests; everything else keeps flowing and results come back in
+completion order.
+"""
+import asyncio
+import logging
+import ssl
+import sys
+
+from hw1 import (TIMEOUT, MAX_REDIRECTS, RECV_SIZE, idna, simple_GET, tls_context, parse_headers,
+                 decode_chunked, decode_body, reparse_url, resolve_redirect,
+                 check_dynamic, split_url)
+
+DEFAULT_CONCURRENCY = 64
+DEFAULT_PER_HOST = 6
+HAPPY_EYEBALLS_DELAY = 0.25
+
+
+def timed(aw):
+    # Like the sync client's socket timeout: TIMEOUT applies to each step, not
+    # to a whole response, so a long but steady body is not cut off
+    return asyncio.wait_for(aw, TIMEOUT)
+
+
+async def read_exactly(reader, n):
+    # readexactly in pieces of at most RECV_SIZE, each with its own timeout
+    parts = []
+    while n > 0:
+        data = await timed(reader.read(min(n, RECV_SIZE)))
+        if not data:
+            raise asyncio.IncompleteReadError(b"".join(parts), None)
+        parts.append(data)
+        n -= len(data)
+    return b"".join(parts)
+
+
+async def read_to_eof(reader):
+    parts = []
+    while True:
+        data = await timed(reader.read(RECV_SIZE))
+        if not data:
+            return b"".join(parts)
+        parts.append(data)
+
+
+async def read_chunked_raw(reader):
+    # Read chunked framing up to and including the trailers, for decode_chunked
+    parts = []
+    while True:
+        size_line = await timed(reader.readuntil(b"\r\n"))
+        parts.append(size_line)
+        try:
+            size = int(size_line[:-2].split(b";", 1)[0].strip(), 16)
+        except ValueError:
+            return None
+        if size == 0:
+            break
+        parts.append(await read_exactly(reader, size + 2))
+    # Trailers end with an empty line
+    while True:
+        line = await timed(reader.readuntil(b"\r\n"))
+        parts.append(line)
+        if line == b"\r\n":
+            return b"".join(parts)
+
+
+async def fetch_once(scheme, host_ascii, port, path):
+    # Send one GET and read one response, return (code, headers_dict, body) or None
+    req = simple_GET(host_ascii, port, path, scheme)
+    if req is None:
+        return None
+    tls = tls_context() if scheme == "https" else None
+    reader, writer = await timed(asyncio.open_connection(
+        host_ascii, port, ssl=tls, server_hostname=host_ascii if tls else None,
+        happy_eyeballs_delay=HAPPY_EYEBALLS_DELAY))
+    try:
+        writer.write(req)
+        await timed(writer.drain())
+
+        # Skip 1xx responses
+        while True:
+            header_block = await timed(reader.readuntil(b"\r\n\r\n"))
+            code, hdrs = parse_headers(header_block[:-4])
+            if code is None:
+                return None
+            if not 100 <= code < 200:
+                break
+
+        te = hdrs.get("transfer-encoding", "").lower()
+        if code in (204, 304):
+            body = b""
+        elif "chunked" in te:
+            raw = await read_chunked_raw(reader)
+            body = None if raw is None else decode_chunked(raw)
+        elif "content-length" in hdrs:
+            body = await read_exactly(reader, int(hdrs["content-length"]))
+        else:
+            body = await read_to_eof(reader)
+        if body is None:
+            return None
+        return code, hdrs, body
+    finally:
+        writer.close()
+
+
+async def full_URL_check(start, host_limits):
+    # Async twin of hw1.full_URL_check: follow redirects and decode the body,
+    # return (final_url_tuple, body_bytes, headers_dict) or (None, None, None)
+    cur_scheme, cur_host, cur_port, cur_path = start
+
+    for _ in range(MAX_REDIRECTS + 1):
+        host_ascii = idna(cur_host)
+        if not host_ascii:
+            return None, None, None
+
+        key = (cur_scheme, host_ascii, cur_port)
+        async with host_limits.get(key):
+            resp = await fetch_once(cur_scheme, host_ascii, cur_port, cur_path)
+        if resp is None:
+            return None, None, None
+        code, hdrs, body = resp
+
+        # Redirects
+        if 300 <= code <= 399:
+            loc = hdrs.get("location")
+            if not loc:
+                return None, None, None
+            parsed = reparse_url(resolve_redirect(cur_scheme, cur_host, cur_port, cur_path, loc))
+            if not parsed:
+                return None, None, None
+            cur_scheme, cur_host, cur_port, cur_path = parsed
+            continue
+
+        # Only final 200 OK is acceptable
+        if code != 200:
+            return None, None, None
+
+        try:
+            body = decode_body(body, hdrs)
+        except (OSError, ValueError):
+            return None, None, None
+        return (cur_scheme, cur_host, cur_port, cur_path), body, hdrs
+
+    # Too many redirects
+    return None, None, None
+
+
+class HostLimits:
+    """
+    One semaphore per (scheme, host, port), created on first use, so no
+    single origin gets more than `per_host` requests in flight.
+    """
+
+    def __init__(self, per_host):
+        self.per_host = per_host
+        self.sems = {}
+
+    def get(self, key):
+        sem = self.sems.get(key)
+        if sem is None:
+            sem = self.sems[key] = asyncio.Semaphore(self.per_host)
+        return sem
+
+
+async def retrieve_one(url, host_limits, sem):
+    """
+    Async version of hw1.retrieve_url. Returns (url, body) where body is
+    None on any failure, matching the synchronous client.
+    """
+    async with sem:
+        try:
+            parsed = split_url(url)
+            if parsed is None:
+                return url, None
+            final1, body1, hdrs1 = await full_URL_check(parsed, host_limits)
+            if final1 is None:
+                return url, None
+            # Only double-fetch if headers suggest content is likely dynamic
+            if check_dynamic(hdrs1):
+                final2, body2, _ = await full_URL_check(final1, host_limits)
+                if final2 is None or body1 != body2:
+                    return url, None
+            return url, body1
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError, OSError, ssl.SSLError, ValueError) as exc:
+            logging.debug("fetch of %s failed: %s", url, exc)
+            return url, None
+
+
+async def iter_retrieve_urls(urls, concurrency=DEFAULT_CONCURRENCY, per_host=DEFAULT_PER_HOST):
+    """
+    Async generator yielding (url, body) pairs as each fetch completes.
+    """
+    sem = asyncio.Semaphore(concurrency)
+    host_limits = HostLimits(per_host)
+    tasks = [asyncio.ensure_future(retrieve_one(url, host_limits, sem)) for url in urls]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            yield await fut
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def retrieve_urls(urls, concurrency=DEFAULT_CONCURRENCY, per_host=DEFAULT_PER_HOST):
+    """
+    Fetch many URLs at once from synchronous code. Yields (url, body) pairs
+    in completion order; body is None wherever hw1.retrieve_url would return
+    None.
+    """
+    loop = asyncio.new_event_loop()
+    agen = iter_retrieve_urls(urls, concurrency, per_host)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.close()
+
+
+if __name__ == "__main__":
+    for url, body in retrieve_urls(sys.argv[1:]):
+        print(url, None if body is None else len(body))
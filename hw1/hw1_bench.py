@@ -0,0 +1,263 @@
+"""
+Benchmarks for the hw1 client.
+
+    python hw1_bench.py recv [size_mb]
+    python hw1_bench.py client [requests]
+    python hw1_bench.py headers
+
+`recv` compares the original receive pipeline (recv into a list, join,
+partition_response, slice past 1xx, decode_chunked) against SocketReader's
+single recv_into buffer, reporting throughput and peak traced memory as a
+multiple of the body size.
+
+`client` drives retrieve_url against the hw1_server fixture for each body
+size and number of concurrent threads, reporting requests/s, p50/p99
+latency and the peak RSS of the process doing the fetching. Each
+configuration runs in its own process so peak RSS is not carried over.
+
+`headers` times parse_headers (decode the block, split into str lines) on
+a typical 14-header response head. It then feeds the head in small pieces
+to the old approach, which rescans and reparses the growing buffer each
+time, and to read_head on a SocketReader, which only searches the new bytes.
+"""
+import gc
+import multiprocessing
+import socket
+import sys
+import threading
+import time
+import timeit
+import tracemalloc
+
+import hw1
+import hw1_server
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+CLIENT_SIZES = (1024, 64 * 1024, 1024 * 1024)
+CLIENT_CONCURRENCY = (1, 8, 32)
+
+
+def make_response(size, chunked):
+    # A 100 Continue followed by a 200 carrying `size` body bytes
+    body = bytes(range(256)) * (size // 256)
+    head = b"HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 200 OK\r\n"
+    if not chunked:
+        return head + b"Content-Length: %d\r\n\r\n" % len(body) + body, body
+    parts = [head, b"Transfer-Encoding: chunked\r\n\r\n"]
+    step = 16 * 1024
+    for i in range(0, len(body), step):
+        piece = body[i:i + step]
+        parts.append(b"%x\r\n" % len(piece))
+        parts.append(piece)
+        parts.append(b"\r\n")
+    parts.append(b"0\r\n\r\n")
+    return b"".join(parts), body
+
+
+def serve_once(payload):
+    # Return a socket that will receive payload and then EOF
+    client, server = socket.socketpair()
+
+    def send():
+        server.sendall(payload)
+        server.close()
+    threading.Thread(target=send, daemon=True).start()
+    return client
+
+
+def baseline_read(sock):
+    # The receive path hw1 used before SocketReader
+    chunks = []
+    while True:
+        data = sock.recv(4096)
+        if not data:
+            break
+        chunks.append(data)
+    raw_response = b"".join(chunks)
+    while True:
+        header_block, body = hw1.partition_response(raw_response)
+        code, hdrs = hw1.parse_headers(header_block)
+        if 100 <= code < 200:
+            sep_idx = raw_response.find(b"\r\n\r\n")
+            raw_response = raw_response[sep_idx + 4:]
+            continue
+        break
+    if "chunked" in hdrs.get("transfer-encoding", "").lower():
+        body = hw1.decode_chunked(body)
+    return body
+
+
+def reader_read(sock):
+    reader = hw1.SocketReader(sock)
+    code, hdrs, _ = hw1.read_head(reader)
+    return hw1.read_body(reader, code, hdrs)
+
+
+def measure(read, payload, expected, repeat=5):
+    # Return (MB/s, peak traced bytes / body bytes)
+    best = None
+    for _ in range(repeat):
+        sock = serve_once(payload)
+        start = time.perf_counter()
+        body = read(sock)
+        elapsed = time.perf_counter() - start
+        sock.close()
+        assert body == expected
+        best = elapsed if best is None else min(best, elapsed)
+        del body
+
+    gc.collect()
+    sock = serve_once(payload)
+    tracemalloc.start()
+    body = read(sock)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    sock.close()
+    return len(expected) / best / 1e6, peak / len(expected)
+
+
+def bench_recv(size_mb=16):
+    size = int(size_mb * 1024 * 1024)
+    print(f"{'framing':<10} {'path':<14} {'MB/s':>8} {'peak/body':>10}")
+    for chunked in (False, True):
+        payload, expected = make_response(size, chunked)
+        for name, read in (("baseline", baseline_read), ("SocketReader", reader_read)):
+            rate, peak = measure(read, payload, expected)
+            framing = "chunked" if chunked else "length"
+            print(f"{framing:<10} {name:<14} {rate:>8.0f} {peak:>10.2f}")
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+
+def client_load(url, concurrency, requests, conn):
+    # Child process: fetch url `requests` times from `concurrency` threads
+    per_thread = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+
+    def worker(idx, count):
+        for _ in range(count):
+            start = time.perf_counter()
+            if hw1.retrieve_url(url) is None:
+                errors[idx] += 1
+            per_thread[idx].append(time.perf_counter() - start)
+
+    counts = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    threads = [threading.Thread(target=worker, args=(i, n)) for i, n in enumerate(counts)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else 0
+    conn.send(([x for lat in per_thread for x in lat], sum(errors), elapsed, peak_kb))
+    conn.close()
+
+
+def bench_client(requests=200):
+    requests = int(requests)
+    print(f"{'body':>8} {'threads':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'peak RSS MB':>12} {'errors':>6}")
+    with hw1_server.LocalServer() as server:
+        for size in CLIENT_SIZES:
+            for concurrency in CLIENT_CONCURRENCY:
+                parent, child = multiprocessing.Pipe(duplex=False)
+                proc = multiprocessing.Process(
+                    target=client_load,
+                    args=(server.url(f"/bytes/{size}"), concurrency, requests, child))
+                proc.start()
+                latencies, errors, elapsed, peak_kb = parent.recv()
+                proc.join()
+                latencies.sort()
+                print(f"{size:>8} {concurrency:>7} {len(latencies) / elapsed:>9.0f} "
+                      f"{percentile(latencies, 0.50) * 1e3:>8.2f} "
+                      f"{percentile(latencies, 0.99) * 1e3:>8.2f} "
+                      f"{peak_kb / 1024:>12.1f} {errors:>6}")
+
+
+SAMPLE_HEAD = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Date: Sat, 17 Oct 2026 10:00:00 GMT\r\n"
+    b"Server: Apache/2.4.41 (Ubuntu)\r\n"
+    b"Content-Type: text/html; charset=UTF-8\r\n"
+    b"Content-Length: 12345\r\n"
+    b"Connection: keep-alive\r\n"
+    b"Cache-Control: max-age=3600, public\r\n"
+    b"ETag: \"abc123\"\r\n"
+    b"Last-Modified: Fri, 16 Oct 2026 10:00:00 GMT\r\n"
+    b"Vary: Accept-Encoding\r\n"
+    b"Set-Cookie: a=1; Path=/\r\n"
+    b"Set-Cookie: b=2; Path=/\r\n"
+    b"X-Frame-Options: DENY\r\n"
+    b"Strict-Transport-Security: max-age=31536000\r\n"
+    b"Accept-Ranges: bytes\r\n\r\n"
+)
+
+
+class PieceSocket:
+    # Stands in for a socket that hands out one piece per recv call
+    def __init__(self, pieces):
+        self.pieces = iter(pieces)
+
+    def recv(self, size):
+        return next(self.pieces, b"")
+
+    def recv_into(self, view):
+        piece = next(self.pieces, b"")
+        view[:len(piece)] = piece
+        return len(piece)
+
+
+def old_incremental(pieces):
+    # How the old code would handle a head arriving in pieces
+    sock = PieceSocket(pieces)
+    raw = b""
+    while True:
+        piece = sock.recv(hw1.RECV_SIZE)
+        if not piece:
+            return None, {}
+        raw += piece
+        header_block, _ = hw1.partition_response(raw)
+        if header_block is not None:
+            return hw1.parse_headers(header_block)
+
+
+def new_incremental(pieces):
+    # A small buffer, so the timing is of the head and not of allocating RECV_SIZE
+    reader = hw1.SocketReader(PieceSocket(pieces), size=1024)
+    return hw1.read_head(reader)
+
+
+def bench_headers(number=20000):
+    block = SAMPLE_HEAD[:-4]
+    step = 64
+    pieces = [SAMPLE_HEAD[i:i + step] for i in range(0, len(SAMPLE_HEAD), step)]
+    cases = (
+        ("parse_headers", lambda: hw1.parse_headers(block)),
+        (f"old, {len(pieces)} pieces", lambda: old_incremental(pieces)),
+        (f"read_head, {len(pieces)} pieces", lambda: new_incremental(pieces)),
+    )
+    print(f"{'parser':<26} {'us/head':>8}")
+    for name, fn in cases:
+        best = min(timeit.repeat(fn, number=number, repeat=7)) / number
+        print(f"{name:<26} {best * 1e6:>8.2f}")
+
+
+def main(args):
+    if not args or args[0] == "recv":
+        bench_recv(*[float(a) for a in args[1:2]])
+    elif args[0] == "client":
+        bench_client(*args[1:2])
+    elif args[0] == "headers":
+        bench_headers()
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
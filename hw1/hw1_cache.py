@@ -0,0 +1,209 @@
+"""
+HTTP response cache for the hw1 client.
+
+Pass a ResponseCache to hw1.retrieve_url(url, cache=...). Responses that
+hw1.check_dynamic considers static are kept in memory, and optionally on
+disk, bounded in bytes with least-recently-used eviction. Fresh entries
+(Cache-Control max-age or Expires) are served without a request. Stale
+entries carrying an ETag or Last-Modified are revalidated with a single
+conditional GET.
+"""
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+import hashlib
+import json
+import logging
+import os
+import time
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def parse_http_date(value):
+    # Return a POSIX timestamp for an HTTP date, or None if unparseable
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def freshness_lifetime(headers, now):
+    """
+    Return the absolute expiry time for a response per Cache-Control
+    max-age, falling back to Expires relative to Date. Responses without
+    either expire immediately and are only useful for revalidation.
+    """
+    age = 0
+    try:
+        age = max(0, int(headers.get("age", "0")))
+    except ValueError:
+        pass
+    for directive in headers.get("cache-control", "").lower().split(","):
+        name, _, value = directive.strip().partition("=")
+        if name == "max-age":
+            try:
+                return now + int(value.strip('"')) - age
+            except ValueError:
+                return now
+    expires = headers.get("expires")
+    if expires:
+        expires_ts = parse_http_date(expires)
+        if expires_ts is None:
+            return now
+        date_ts = parse_http_date(headers.get("date", "")) or now
+        return now + (expires_ts - date_ts) - age
+    return now
+
+
+class CacheEntry:
+    """
+    One cached response: the final URL tuple it was fetched from after
+    redirects, the response headers, the body and when it goes stale.
+    """
+
+    def __init__(self, final, headers, body, expires_at):
+        self.final = final
+        self.headers = headers
+        self.body = body
+        self.expires_at = expires_at
+
+    def is_fresh(self):
+        return time.time() < self.expires_at
+
+    def conditional_headers(self):
+        # Validators to send with a revalidation request
+        hdrs = {}
+        if "etag" in self.headers:
+            hdrs["If-None-Match"] = self.headers["etag"]
+        if "last-modified" in self.headers:
+            hdrs["If-Modified-Since"] = self.headers["last-modified"]
+        return hdrs
+
+    def cacheable(self):
+        # Worth keeping only if it can be served fresh or revalidated
+        return self.is_fresh() or bool(self.conditional_headers())
+
+
+class ResponseCache:
+    """
+    In-memory LRU of CacheEntry objects bounded by total body size. With a
+    directory, entries are also written through to disk (bounded the same
+    way, by file modification time) so they survive across processes.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, directory=None, max_disk_bytes=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_bytes if max_disk_bytes is None else max_disk_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, url):
+        entry = self.entries.get(url)
+        if entry is not None:
+            self.entries.move_to_end(url)
+        elif self.directory is not None:
+            entry = self.load(url)
+            if entry is not None:
+                self.remember(url, entry)
+        if entry is None:
+            self.misses += 1
+        elif entry.is_fresh():
+            self.hits += 1
+        return entry
+
+    def put(self, url, final, headers, body):
+        entry = CacheEntry(final, headers, body, freshness_lifetime(headers, time.time()))
+        if not entry.cacheable() or len(body) > self.max_bytes:
+            self.discard(url)
+            return
+        self.remember(url, entry)
+        self.save(url, entry)
+
+    def refresh(self, url, headers):
+        # A 304 confirmed the entry: take the new headers and restart its lifetime
+        entry = self.entries.get(url)
+        if entry is None:
+            return
+        self.revalidated += 1
+        entry.headers = {**entry.headers, **headers}
+        entry.expires_at = freshness_lifetime(entry.headers, time.time())
+        self.save(url, entry)
+
+    def discard(self, url):
+        entry = self.entries.pop(url, None)
+        if entry is not None:
+            self.size -= len(entry.body)
+        if self.directory is not None:
+            try:
+                os.remove(self.path(url))
+            except OSError:
+                pass
+
+    def remember(self, url, entry):
+        old = self.entries.pop(url, None)
+        if old is not None:
+            self.size -= len(old.body)
+        self.entries[url] = entry
+        self.size += len(entry.body)
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted.body)
+
+    # On-disk storage: one file per URL, a JSON metadata line then the body
+
+    def path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode("utf-8")).hexdigest())
+
+    def load(self, url):
+        try:
+            with open(self.path(url), "rb") as handle:
+                meta = json.loads(handle.readline())
+                body = handle.read()
+            os.utime(self.path(url))
+        except (OSError, ValueError):
+            return None
+        if meta.get("url") != url or len(body) != meta.get("length"):
+            return None
+        return CacheEntry(tuple(meta["final"]), meta["headers"], body, meta["expires_at"])
+
+    def save(self, url, entry):
+        if self.directory is None:
+            return
+        meta = {"url": url, "final": entry.final, "headers": entry.headers,
+                "expires_at": entry.expires_at, "length": len(entry.body)}
+        tmp = self.path(url) + ".tmp"
+        try:
+            with open(tmp, "wb") as handle:
+                handle.write(json.dumps(meta).encode("utf-8") + b"\n")
+                handle.write(entry.body)
+            os.replace(tmp, self.path(url))
+        except OSError as exc:
+            logging.debug("could not write cache entry for %s: %s", url, exc)
+            return
+        self.trim_disk()
+
+    def trim_disk(self):
+        # Delete least recently used files until the directory fits max_disk_bytes
+        files = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for item in it:
+                if item.is_file() and not item.name.endswith(".tmp"):
+                    st = item.stat()
+                    files.append((st.st_mtime, st.st_size, item.path))
+                    total += st.st_size
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,161 @@
+"""
+Shared DNS cache and Happy Eyeballs connect for the hw1 client.
+
+Install with `hw1.RESOLVER = hw1_dns.Resolver()`. Every open_socket call
+then reuses cached getaddrinfo results instead of going back to the system
+resolver. Connects race the cached IPv6/IPv4 addresses (RFC 8305), so one
+unreachable family costs a short stagger delay rather than a full timeout.
+getaddrinfo does not expose record TTLs, so entries live for a fixed,
+configurable TTL; failed lookups are cached for a shorter negative TTL.
+"""
+import errno
+import os
+import selectors
+import socket
+import threading
+import time
+
+DEFAULT_TTL = 300
+DEFAULT_NEGATIVE_TTL = 30
+DEFAULT_ATTEMPT_DELAY = 0.25
+MAX_ENTRIES = 4096
+
+IN_PROGRESS = (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN)
+
+
+def interleave(addrs):
+    # Alternate address families, keeping the resolver's preferred family first
+    by_family = {}
+    for addr in addrs:
+        by_family.setdefault(addr[0], []).append(addr)
+    queues = list(by_family.values())
+    out = []
+    while queues:
+        for q in queues:
+            out.append(q.pop(0))
+        queues = [q for q in queues if q]
+    return out
+
+
+class Resolver:
+    """
+    Thread-safe host -> addrinfo cache with positive and negative TTLs.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL,
+                 attempt_delay=DEFAULT_ATTEMPT_DELAY):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.attempt_delay = attempt_delay
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, host, port):
+        """
+        Return a list of getaddrinfo tuples for host:port, raising
+        socket.gaierror (possibly from the negative cache) on failure.
+        """
+        key = (host, port)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                if isinstance(entry[1], Exception):
+                    # A new error each time: re-raising the cached one would
+                    # grow its traceback by every caller's frames
+                    raise socket.gaierror(*entry[1].args)
+                return entry[1]
+            self.misses += 1
+        # Resolve outside the lock so one slow name does not block the others
+        try:
+            addrs = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except socket.gaierror as exc:
+            # Cache a copy without the traceback, which would keep this call's frames alive
+            self.store(key, now + self.negative_ttl, socket.gaierror(*exc.args))
+            raise
+        self.store(key, now + self.ttl, addrs)
+        return addrs
+
+    def store(self, key, expires, value):
+        with self.lock:
+            if len(self.entries) >= MAX_ENTRIES:
+                now = time.monotonic()
+                self.entries = {k: v for k, v in self.entries.items() if v[0] > now}
+                if len(self.entries) >= MAX_ENTRIES:
+                    self.entries.clear()
+            self.entries[key] = (expires, value)
+
+    def forget(self, host, port):
+        with self.lock:
+            self.entries.pop((host, port), None)
+
+    def connect(self, host, port, timeout=None):
+        """
+        Drop-in for socket.create_connection. Starts a connect to the next
+        address every `attempt_delay` seconds (or as soon as one fails) and
+        returns the first socket to complete, closing the rest.
+        """
+        addrs = interleave(self.resolve(host, port))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        sel = selectors.DefaultSelector()
+        pending = []
+        last_error = None
+        next_idx = 0
+        next_start = time.monotonic()
+        try:
+            while True:
+                now = time.monotonic()
+                # Start the next attempt when its stagger delay is up or nothing else is running
+                if next_idx < len(addrs) and (now >= next_start or not pending):
+                    family, type_, proto, _, sockaddr = addrs[next_idx]
+                    next_idx += 1
+                    try:
+                        # Fails with EAFNOSUPPORT for an IPv6 address on a host without IPv6
+                        sock = socket.socket(family, type_, proto)
+                    except OSError as exc:
+                        last_error = exc
+                        continue
+                    sock.setblocking(False)
+                    try:
+                        err = sock.connect_ex(sockaddr)
+                    except OSError as exc:
+                        last_error = exc
+                        sock.close()
+                        continue
+                    if err == 0:
+                        sock.settimeout(timeout)
+                        return sock
+                    if err not in IN_PROGRESS:
+                        last_error = OSError(err, os.strerror(err))
+                        sock.close()
+                        continue
+                    sel.register(sock, selectors.EVENT_WRITE)
+                    pending.append(sock)
+                    next_start = now + self.attempt_delay
+                if not pending:
+                    self.forget(host, port)
+                    raise last_error or OSError(f"no addresses for {host}")
+                if deadline is not None and now >= deadline:
+                    raise socket.timeout("timed out")
+
+                wait = None if deadline is None else deadline - now
+                if next_idx < len(addrs):
+                    stagger = max(0.0, next_start - now)
+                    wait = stagger if wait is None else min(wait, stagger)
+                for key, _ in sel.select(wait):
+                    sock = key.fileobj
+                    sel.unregister(sock)
+                    pending.remove(sock)
+                    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if err == 0:
+                        sock.settimeout(timeout)
+                        return sock
+                    last_error = OSError(err, os.strerror(err))
+                    sock.close()
+        finally:
+            for sock in pending:
+                sock.close()
+            sel.close()
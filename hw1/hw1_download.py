@@ -0,0 +1,198 @@
+"""
+Segmented, resumable downloads for the hw1 client.
+
+    python hw1_download.py URL PATH [connections]
+
+The first request asks for the first segment with a Range header. If the
+server answers 206 with a Content-Range total, the remaining segments are
+fetched over several parallel pooled connections and written straight into
+a memory-mapped, preallocated output file. Finished segments are recorded in
+PATH.progress. A later call with the same URL and PATH skips them, as long as
+the server still reports the same ETag/Last-Modified. Servers without range
+support get a plain streamed download. Ranges count bytes of the encoded
+body, so every request asks for the identity encoding.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import mmap
+import os
+import sys
+import threading
+
+import hw1
+
+DEFAULT_CONNECTIONS = 4
+SEGMENT_SIZE = 8 * 1024 * 1024
+
+
+def parse_content_range(value):
+    # "bytes start-end/total" -> (start, end, total), or None
+    unit, _, rng = value.partition(" ")
+    if unit.strip().lower() != "bytes":
+        return None
+    span, _, total = rng.partition("/")
+    first, _, last = span.partition("-")
+    try:
+        return int(first), int(last), int(total)
+    except ValueError:
+        return None
+
+
+def validator(hdrs):
+    # A strong ETag or Last-Modified, usable with If-Range
+    etag = hdrs.get("etag", "")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return hdrs.get("last-modified")
+
+
+class Progress:
+    """
+    Which segments of PATH are already on disk, persisted next to it so an
+    interrupted download can pick up where it stopped.
+    """
+
+    def __init__(self, path, url, total, segment_size, valid):
+        self.path = path + ".progress"
+        self.state = {"url": url, "total": total, "segment_size": segment_size,
+                      "validator": valid, "done": []}
+        self.done = set()
+        self.lock = threading.Lock()
+
+    def resume(self, output_path):
+        # Adopt the saved state if it describes this same download
+        try:
+            with open(self.path) as handle:
+                saved = json.load(handle)
+        except (OSError, ValueError):
+            return
+        same = all(saved.get(k) == self.state[k] for k in ("url", "total", "segment_size", "validator"))
+        if same and self.state["validator"] and os.path.exists(output_path):
+            self.done = set(saved.get("done", []))
+
+    def mark(self, index):
+        with self.lock:
+            self.done.add(index)
+            self.state["done"] = sorted(self.done)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as handle:
+                json.dump(self.state, handle)
+            os.replace(tmp, self.path)
+
+    def finish(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def write_body(body, view, start, expected):
+    # Copy a streamed Body into view[start:], checking it is exactly `expected` bytes long
+    pos = start
+    for chunk in body:
+        if pos + len(chunk) > start + expected:
+            raise ValueError("server sent more than the requested range")
+        view[pos:pos + len(chunk)] = chunk
+        pos += len(chunk)
+    if pos != start + expected:
+        raise ConnectionError("range cut short")
+
+
+def fetch_segment(final, index, segment_size, total, valid, view, progress):
+    start = index * segment_size
+    end = min(total, start + segment_size) - 1
+    extra = {"Range": f"bytes={start}-{end}", "Accept-Encoding": "identity"}
+    if valid:
+        extra["If-Range"] = valid
+    _, code, hdrs, body = hw1.open_url(*final, extra_headers=extra)
+    if code != 206:
+        if body is not None:
+            body.close()
+        raise ValueError(f"segment {index}: expected 206, got {code}")
+    rng = parse_content_range(hdrs.get("content-range", ""))
+    if rng is None or rng[0] != start or rng[2] != total:
+        body.close()
+        raise ValueError(f"segment {index}: unexpected Content-Range")
+    write_body(body, view, start, end - start + 1)
+    progress.mark(index)
+
+
+def stream_to_file(body, path):
+    # No range support: plain streamed download
+    written = 0
+    with open(path, "wb") as handle:
+        for chunk in body:
+            handle.write(chunk)
+            written += len(chunk)
+    return written
+
+
+def download(url, path, connections=DEFAULT_CONNECTIONS, segment_size=SEGMENT_SIZE):
+    """
+    Download url into path, returning the number of bytes written or None on
+    failure. After a failure the progress file is kept so that calling
+    download again resumes.
+    """
+    parsed = hw1.split_url(url)
+    if parsed is None:
+        return None
+    probe = {"Range": f"bytes=0-{segment_size - 1}", "Accept-Encoding": "identity"}
+    final, code, hdrs, body = hw1.open_url(*parsed, extra_headers=probe)
+    if final is None:
+        return None
+    try:
+        if code == 200:
+            return stream_to_file(body, path)
+        rng = parse_content_range(hdrs.get("content-range", ""))
+        if code != 206 or rng is None or rng[0] != 0 or rng[1] != min(rng[2], segment_size) - 1:
+            body.close()
+            return None
+    except (OSError, ValueError) as exc:
+        logging.error("download of %s failed: %s", url, exc)
+        return None
+
+    total = rng[2]
+    valid = validator(hdrs)
+    progress = Progress(path, url, total, segment_size, valid)
+    progress.resume(path)
+    segments = (total + segment_size - 1) // segment_size
+
+    with open(path, "r+b" if progress.done else "w+b") as handle:
+        handle.truncate(total)
+        if total == 0:
+            body.read()
+            progress.finish()
+            return 0
+        with mmap.mmap(handle.fileno(), total) as mm:
+            view = memoryview(mm)
+            try:
+                # The probe already carries segment 0
+                write_body(body, view, 0, rng[1] + 1)
+                progress.mark(0)
+                todo = [i for i in range(1, segments) if i not in progress.done]
+                with ThreadPoolExecutor(max_workers=connections) as pool:
+                    futures = [pool.submit(fetch_segment, final, i, segment_size, total,
+                                           valid, view, progress) for i in todo]
+                    try:
+                        for fut in futures:
+                            fut.result()
+                    except BaseException:
+                        # Segments not yet started stay for the next attempt
+                        for fut in futures:
+                            fut.cancel()
+                        raise
+            except (OSError, ValueError) as exc:
+                logging.error("download of %s stopped, %d/%d segments saved: %s",
+                              url, len(progress.done), segments, exc)
+                return None
+            finally:
+                view.release()
+    progress.finish()
+    return total
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    conns = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_CONNECTIONS
+    print(download(sys.argv[1], sys.argv[2], conns))
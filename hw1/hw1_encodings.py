@@ -0,0 +1,92 @@
+"""
+Extra Content-Encoding decoders for the hw1 client.
+
+hw1.py can only use gzip, so deflate and Brotli decoders live here. Call
+`hw1_encodings.install()` to add them to hw1.DECODERS; after that they are
+decoded and also advertised in Accept-Encoding. Brotli needs the optional
+`brotli` (or `brotlicffi`) package and is left out if neither is installed.
+
+Each decoder produces output in windows of at most hw1.RECV_SIZE bytes, so
+hw1.MAX_DECODED_SIZE stops a decompression bomb before it fills memory.
+"""
+import zlib
+
+import hw1
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+# Brotli cannot cap its output, so feed it small slices of input instead
+BROTLI_INPUT_STEP = 4096
+
+
+def zlib_wrapped(head):
+    # RFC 1950 header check: deflate method and a valid FCHECK
+    return len(head) >= 2 and head[0] & 0x0F == 8 and (head[0] << 8 | head[1]) % 31 == 0
+
+
+def inflate_chunks(chunks):
+    """
+    Yield a "deflate" body decompressed. The coding is meant to be the zlib
+    format, but some servers send raw deflate, so the first two bytes pick
+    which one.
+    """
+    decomp = None
+    head = b""
+    try:
+        for chunk in chunks:
+            if decomp is None:
+                head += chunk
+                if len(head) < 2:
+                    continue
+                decomp = zlib.decompressobj(zlib.MAX_WBITS if zlib_wrapped(head) else -zlib.MAX_WBITS)
+                chunk, head = head, b""
+            data = decomp.decompress(chunk, hw1.RECV_SIZE)
+            while True:
+                if data:
+                    yield data
+                if not decomp.unconsumed_tail:
+                    break
+                data = decomp.decompress(decomp.unconsumed_tail, hw1.RECV_SIZE)
+        if decomp is None:
+            if head:
+                raise ValueError("truncated deflate body")
+            return
+        data = decomp.flush()
+        if data:
+            yield data
+        if not decomp.eof:
+            raise ValueError("truncated deflate body")
+    except zlib.error as exc:
+        raise ValueError("bad deflate body") from exc
+
+
+def unbrotli_chunks(chunks):
+    # Yield a "br" body decompressed
+    decomp = brotli.Decompressor()
+    seen = False
+    try:
+        for chunk in chunks:
+            seen = seen or bool(chunk)
+            view = memoryview(chunk)
+            for i in range(0, len(view), BROTLI_INPUT_STEP):
+                data = decomp.process(bytes(view[i:i + BROTLI_INPUT_STEP]))
+                for j in range(0, len(data), hw1.RECV_SIZE):
+                    yield data[j:j + hw1.RECV_SIZE]
+    except brotli.error as exc:
+        raise ValueError("bad brotli body") from exc
+    if seen and not decomp.is_finished():
+        raise ValueError("truncated brotli body")
+
+
+def install():
+    # Register the decoders available here with hw1; returns the Accept-Encoding value
+    hw1.DECODERS["deflate"] = inflate_chunks
+    if brotli is not None:
+        hw1.DECODERS["br"] = unbrotli_chunks
+    return hw1.accept_encoding()
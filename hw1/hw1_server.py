@@ -0,0 +1,252 @@
+"""
+Local HTTP/1.1 server fixture for testing and benchmarking the hw1 client
+offline.
+
+    with LocalServer() as server:
+        retrieve_url(server.url("/chunked/65536"))
+
+Paths (n is a byte count, bodies are payload(n)):
+    /bytes/n            Content-Length body with an ETag, honouring a single Range
+                        and answering a matching If-None-Match with 304
+    /chunked/n          chunked body in CHUNK_SIZE pieces
+    /gzip/n             gzip Content-Encoding, Content-Length framing
+    /deflate/n          zlib-wrapped deflate Content-Encoding
+    /stacked/n          "deflate, gzip" Content-Encoding, chunked framing
+    /continue/n         100 Continue before the 200
+    /redirect/k         302 chain of k hops ending at /bytes/16
+    /drip/n/ms          chunked body sent CHUNK_SIZE bytes every ms milliseconds
+    /dynamic            Set-Cookie and a different body on every request
+    /cookie/n           Set-Cookie (so it looks dynamic) with a strong ETag, answering
+                        a matching If-None-Match with 304
+    /close/n            body delimited by closing the connection
+Anything else is a 404. SENT counts the status codes sent, so a test can tell
+a 304 revalidation from a full second fetch.
+"""
+import asyncio
+from collections import Counter
+import gzip
+import logging
+import os
+import sys
+import threading
+import zlib
+
+CHUNK_SIZE = 8192
+PATTERN = bytes(range(256)) * 64
+SENT = Counter()
+
+
+def payload(n):
+    # Deterministic body of n bytes, so clients can check what they got
+    reps, rest = divmod(n, len(PATTERN))
+    return PATTERN * reps + PATTERN[:rest]
+
+
+def head(code, reason, headers):
+    SENT[code] += 1
+    lines = [f"HTTP/1.1 {code} {reason}"]
+    lines += [f"{k}: {v}" for k, v in headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("ascii")
+
+
+def parse_count(part):
+    try:
+        return max(0, int(part))
+    except ValueError:
+        return None
+
+
+async def send_chunked(writer, body, delay=0.0):
+    for i in range(0, len(body), CHUNK_SIZE):
+        piece = body[i:i + CHUNK_SIZE]
+        writer.writelines([b"%x\r\n" % len(piece), piece, b"\r\n"])
+        await writer.drain()
+        if delay:
+            await asyncio.sleep(delay)
+    writer.write(b"0\r\n\r\n")
+
+
+def parse_range(value, size):
+    # "bytes=a-b" (or "bytes=a-") -> (start, end) within size, or None
+    unit, _, span = value.partition("=")
+    first, _, last = span.partition("-")
+    if unit.strip().lower() != "bytes" or "," in span:
+        return None
+    try:
+        start = int(first)
+        end = min(size - 1, int(last)) if last.strip() else size - 1
+    except ValueError:
+        return None
+    if start > end:
+        return None
+    return start, end
+
+
+async def respond(path, headers, writer):
+    """
+    Write one response for path. Returns False if the connection must close
+    afterwards.
+    """
+    parts = path.strip("/").split("/")
+    kind = parts[0]
+    n = parse_count(parts[1]) if len(parts) > 1 else None
+
+    if kind == "bytes" and n is not None:
+        body = payload(n)
+        etag = f'"bytes-{n}"'
+        rng = parse_range(headers.get("range", ""), n)
+        if headers.get("if-none-match") == etag:
+            writer.write(head(304, "Not Modified", [("ETag", etag)]))
+        elif rng is not None and headers.get("if-range", etag) == etag:
+            start, end = rng
+            writer.writelines([head(206, "Partial Content", [
+                ("ETag", etag), ("Content-Range", f"bytes {start}-{end}/{n}"),
+                ("Content-Length", end - start + 1)]), body[start:end + 1]])
+        else:
+            writer.writelines([head(200, "OK", [("ETag", etag), ("Accept-Ranges", "bytes"),
+                                                ("Content-Length", len(body))]), body])
+    elif kind == "chunked" and n is not None:
+        writer.write(head(200, "OK", [("Transfer-Encoding", "chunked")]))
+        await send_chunked(writer, payload(n))
+    elif kind == "gzip" and n is not None:
+        body = gzip.compress(payload(n), compresslevel=1)
+        writer.writelines([head(200, "OK", [("Content-Encoding", "gzip"),
+                                            ("Content-Length", len(body))]), body])
+    elif kind == "deflate" and n is not None:
+        body = zlib.compress(payload(n), 1)
+        writer.writelines([head(200, "OK", [("Content-Encoding", "deflate"),
+                                            ("Content-Length", len(body))]), body])
+    elif kind == "stacked" and n is not None:
+        writer.write(head(200, "OK", [("Content-Encoding", "deflate, gzip"),
+                                      ("Transfer-Encoding", "chunked")]))
+        await send_chunked(writer, gzip.compress(zlib.compress(payload(n), 1), compresslevel=1))
+    elif kind == "continue" and n is not None:
+        body = payload(n)
+        writer.writelines([b"HTTP/1.1 100 Continue\r\n\r\n",
+                           head(200, "OK", [("Content-Length", len(body))]), body])
+    elif kind == "redirect" and n is not None:
+        target = f"/redirect/{n - 1}" if n > 1 else "/bytes/16"
+        writer.write(head(302, "Found", [("Location", target), ("Content-Length", 0)]))
+    elif kind == "drip" and n is not None and len(parts) > 2:
+        delay = (parse_count(parts[2]) or 0) / 1000
+        writer.write(head(200, "OK", [("Transfer-Encoding", "chunked")]))
+        await send_chunked(writer, payload(n), delay)
+    elif kind == "dynamic":
+        body = os.urandom(32)
+        writer.writelines([head(200, "OK", [("Set-Cookie", "session=1"),
+                                            ("Content-Length", len(body))]), body])
+    elif kind == "cookie" and n is not None:
+        etag = f'"cookie-{n}"'
+        if headers.get("if-none-match") == etag:
+            writer.write(head(304, "Not Modified", [("ETag", etag)]))
+        else:
+            body = payload(n)
+            writer.writelines([head(200, "OK", [("Set-Cookie", "session=1"), ("ETag", etag),
+                                                ("Content-Length", len(body))]), body])
+    elif kind == "close" and n is not None:
+        writer.writelines([head(200, "OK", [("Connection", "close")]), payload(n)])
+        return False
+    else:
+        writer.write(head(404, "Not Found", [("Content-Length", 0)]))
+    return True
+
+
+async def handle(reader, writer):
+    # Serve keep-alive requests until the client goes away
+    try:
+        while True:
+            try:
+                request = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            lines = request.decode("iso-8859-1").split("\r\n")
+            parts = lines[0].split(" ")
+            if len(parts) != 3 or parts[0] != "GET":
+                writer.write(head(400, "Bad Request", [("Connection", "close")]))
+                return
+            headers = {}
+            for ln in lines[1:]:
+                k, sep, v = ln.partition(":")
+                if sep:
+                    headers[k.strip().lower()] = v.strip()
+            keep_alive = await respond(parts[1], headers, writer)
+            await writer.drain()
+            if not keep_alive or headers.get("connection", "").lower() == "close":
+                return
+    except (ConnectionResetError, BrokenPipeError):
+        pass
+    finally:
+        writer.close()
+
+
+class LocalServer:
+    """
+    Runs the fixture on its own event loop in a daemon thread, listening on
+    an ephemeral port on 127.0.0.1.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.writers = set()
+
+    async def serve(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            await handle(reader, writer)
+        finally:
+            self.writers.discard(writer)
+
+    def start(self):
+        ready = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self.serve, self.host, self.port, backlog=1024))
+            self.port = self.server.sockets[0].getsockname()[1]
+            ready.set()
+            self.loop.run_forever()
+            # Idle keep-alive handlers are still waiting for requests: hand them EOF
+            self.server.close()
+            for writer in list(self.writers):
+                writer.close()
+            tasks = asyncio.all_tasks(self.loop)
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.run_until_complete(self.server.wait_closed())
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop = None
+
+    def url(self, path):
+        return f"http://{self.host}:{self.port}{path}"
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    with LocalServer(port=port) as srv:
+        logging.info("serving on %s", srv.url("/"))
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
@@ -2,8 +2,16 @@
 test cases for a simple http client.
 '''
 import logging
+import os
 import sys
-from hw1 import retrieve_url
+import tempfile
+from hw1 import iter_url, retrieve_url, retrieve_pipelined
+from hw1_batch import retrieve_urls
+from hw1_cache import ResponseCache
+from hw1_download import download
+import hw1_encodings
+import hw1_server
+from hw1_server import LocalServer, payload
 
 from subprocess import Popen, PIPE
 
@@ -24,6 +32,84 @@ TEST_CASES_BONUS = [
     'https://store.steampowered.com/' # dynamic page
 ]
 
+# Offline cases served by hw1_server, as (path, expected output)
+LOCAL_CASES = [
+    ('/bytes/1000', payload(1000)),  # content-length
+    ('/chunked/100000', payload(100000)),  # chunked encoding
+    ('/gzip/50000', payload(50000)),  # gzip content-encoding
+    ('/deflate/50000', payload(50000)),  # deflate content-encoding (hw1_encodings)
+    ('/stacked/50000', payload(50000)),  # deflate then gzip, chunked
+    ('/continue/10', payload(10)),  # 100 continue first
+    ('/redirect/5', payload(16)),  # redirect chain
+    ('/drip/32768/5', payload(32768)),  # slow-drip chunked body
+    ('/close/300', payload(300)),  # body ends when the connection closes
+    ('/bytes/4194304', payload(4194304)),  # large body
+    ('/dynamic', None),  # dynamic page
+    ('/doesnotexist', None),  # causes 404
+]
+
+
+def fetch_cached(url):
+    # Second fetch through a ResponseCache must be revalidated with a 304
+    cache = ResponseCache()
+    first = retrieve_url(url, cache)
+    second = retrieve_url(url, cache)
+    return second if first == second and cache.revalidated == 1 else None
+
+def fetch_pipelined(url):
+    # Several GETs for the same URL pipelined on one connection
+    bodies = retrieve_pipelined([url] * 5)
+    return bodies[0] if bodies.count(bodies[0]) == len(bodies) else None
+
+def fetch_streamed(url):
+    # Body streamed through iter_url
+    body = iter_url(url)
+    return None if body is None else b"".join(body)
+
+def fetch_streamed_size(url):
+    # Bytes streamed through iter_url, for bodies that differ on every request
+    body = iter_url(url)
+    return None if body is None else sum(len(chunk) for chunk in body)
+
+def fetch_verified(url):
+    # Dynamic-looking page with a strong ETag: retrieve_url's second fetch must be a 304
+    not_modified = hw1_server.SENT[304]
+    body = retrieve_url(url)
+    return body if hw1_server.SENT[304] == not_modified + 1 else None
+
+def fetch_batch(url):
+    # Every LOCAL_CASES path at once through hw1_batch.retrieve_urls, url being
+    # the server root. Returns the bodies in LOCAL_CASES order
+    urls = [url.rstrip("/") + path for path, _ in LOCAL_CASES]
+    bodies = dict(retrieve_urls(urls))
+    return [bodies[u] for u in urls]
+
+def fetch_download(url):
+    # Segmented download into a temporary file
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "out")
+        size = download(url, path, segment_size=65536)
+        if size is None:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+# Offline cases for the other ways of fetching, as (fetch function, path, expected output)
+LOCAL_FETCH_CASES = [
+    (fetch_cached, '/bytes/1000', payload(1000)),  # response cache, 304 revalidation
+    (fetch_verified, '/cookie/1000', payload(1000)),  # dynamic check answered with a 304
+    (fetch_streamed, '/chunked/100000', payload(100000)),  # streamed chunked body
+    (fetch_streamed, '/gzip/50000', payload(50000)),  # streamed gzip body
+    (fetch_streamed, '/stacked/50000', payload(50000)),  # streamed stacked codings
+    (fetch_streamed_size, '/dynamic', 32),  # dynamic page streamed without a second fetch
+    (fetch_streamed, '/doesnotexist', None),  # 404 streams nothing
+    (fetch_batch, '/', [expected for _, expected in LOCAL_CASES]),  # mixed async batch
+    (fetch_pipelined, '/chunked/100000', payload(100000)),  # pipelined requests
+    (fetch_pipelined, '/dynamic', None),  # pipelined dynamic page
+    (fetch_download, '/bytes/300000', payload(300000)),  # segmented Range download
+    (fetch_download, '/chunked/100000', payload(100000)),  # no Range support
+]
+
 
 def extract_status_code(input_url):
     process = Popen(['curl', '-I','-L', input_url, '--http1.1'], stdout=PIPE, stderr=PIPE)
@@ -70,10 +156,35 @@ def compare_output(url):
     else:
         print("incorrect output for {}".format(url))
 
+def run_local_cases():
+    '''
+    check retrieve_url and the other fetchers against the local fixture
+    server, no network needed
+    '''
+    hw1_encodings.install()
+    cases = [(retrieve_url, path, expected) for path, expected in LOCAL_CASES]
+    with LocalServer() as server:
+        for fetch, path, expected in cases + LOCAL_FETCH_CASES:
+            url = server.url(path)
+            try:
+                output = fetch(url)
+            except Exception as exc:
+                print("uncaught exception ({}) in {} for {}".format(type(exc).__name__, fetch.__name__, url))
+                continue
+            if output == expected:
+                print("correct output in {} for {}".format(fetch.__name__, url))
+            else:
+                print("incorrect output in {} for {}".format(fetch.__name__, url))
+
 def main(args):
     if "--debug" in args:
         logging.basicConfig(level=logging.DEBUG)
 
+    if "--local" in args:
+        print("Trying local cases:")
+        run_local_cases()
+        return
+
     print("Trying Base cases:")
 
     for testcase in TEST_CASES:
@@ -74,8 +74,8 @@ async def client(host, port, loop):
     except ConnectionResetError:
         logging.error("ConnectionResetError")
         return 0
-    except asyncio.streams.IncompleteReadError:
-        logging.error("asyncio.streams.IncompleteReadError")
+    except asyncio.IncompleteReadError:
+        logging.error("asyncio.IncompleteReadError")
         return 0
     except OSError:
         logging.error("OSError")
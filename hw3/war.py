@@ -2,7 +2,7 @@
 war card game client and server
 """
 import asyncio
-from collections import namedtuple
+from collections import deque, namedtuple
 from enum import Enum
 import logging
 import random
@@ -18,7 +18,53 @@ for each game which contain the game's state, for instance things like the
 socket, the cards given, the cards still available, etc.
 """
 Game = namedtuple("Game", ["p1", "p2"])
-WAITING = []
+
+# Seconds a client may wait for an opponent before it is dropped; None waits forever
+MAX_WAIT = 60
+# How often the waiting queue is swept for timed out and disconnected clients
+SWEEP_INTERVAL = 1.0
+# In `server --workers N` mode: seconds a client waits for an opponent in its
+# own worker before it is handed to the lobby worker
+HANDOFF_DELAY = 0.05
+# Set in workers other than the lobby: datagram socket the lobby receives connections on
+HANDOFF = None
+# Bytes queued on a player's transport before play_one_game waits for it to drain
+DRAIN_THRESHOLD = 16 * 1024
+# Seconds a player may take over each message: its WANTGAME after connecting,
+# then its PLAYCARD in every round. None for no limit
+MESSAGE_TIMEOUT = 30
+# Seconds a whole game may take; None for no limit
+GAME_TIMEOUT = 300
+# Timer wheel resolution and size: timeouts fire up to one tick late, and ones
+# longer than TIMER_SLOTS ticks go round the wheel more than once
+TIMER_TICK = 0.1
+TIMER_SLOTS = 1024
+# "streams" (a play_one_game coroutine per game) or "protocol" (WarProtocol callbacks)
+ENGINE = "streams"
+# Local port serving plain-text metrics (`--metrics PORT`); None for no listener.
+# With --workers N, worker i serves its own on METRICS_PORT + i
+METRICS_PORT = None
+# Seconds between samples of event loop lag, games/s and rounds/s
+METRICS_INTERVAL = 1.0
+# Why games and waiting clients get closed: the kill_game call sites and timeouts
+ERROR_REASONS = ("bad_wantgame", "not_playcard", "card_out_of_range", "card_not_held",
+                 "card_repeated", "played_twice", "timeout", "disconnect")
+# File every game is recorded to (`--record PATH`, see war_record); None to not record.
+# With --workers N, worker i records to PATH.i
+RECORD_PATH = None
+# Admission control: a new connection is closed at once (shed) while
+# MAX_GAMES games are in progress or MAX_WAITING clients are waiting for a
+# game (connected but not yet playing). None for no limit
+MAX_GAMES = 20000
+MAX_WAITING = 10000
+# Seconds of event loop lag at which the server stops accepting connections;
+# it starts again once the lag is under half of that. None to always accept
+MAX_LAG = 0.25
+# How often the event loop lag is checked for MAX_LAG
+LAG_CHECK_INTERVAL = 0.05
+# Hands to deal instead of shuffling (`--deals LOG`): an iterator of
+# (hand1, hand2) from a recorded log; shuffling resumes once it runs out
+DEALS = None
 
 class Command(Enum):
     """
@@ -38,6 +84,15 @@ class Result(Enum):
     DRAW = 1
     LOSE = 2
 
+# PLAYRESULT messages indexed by Result value, built once rather than every round
+PLAYRESULT = tuple(bytes([Command.PLAYRESULT.value, r.value]) for r in Result)
+
+def gamestart(hand):
+    """
+    The GAMESTART message for a hand, built as one buffer (one send).
+    """
+    return bytes((Command.GAMESTART.value, *hand))
+
 def readexactly(sock, numbytes):
     """
     Accumulate exactly `numbytes` from `sock` and return those. If EOF is found
@@ -59,31 +114,22 @@ def readexactly(sock, numbytes):
 
 def kill_game(game):
     """
-    TODO: If either client sends a bad message, immediately nuke the game.
+    If either client sends a bad message, immediately nuke the game: abort
+    both connections, dropping anything still queued for them, without
+    waiting for them to close. Players are (reader, writer) pairs, objects
+    with a transport (WarProtocol) or plain sockets. Calling it again, or
+    on players that already hung up, does nothing.
     """
-    # Loop over players and endpints
-    for side in (game.p1, game.p2):
+    for side in game:
         if side is None: # Missing endpoint
             continue
-        # Close 
-        try:
-            if isinstance(side, tuple) and len(side) == 2: # asyncio style tuple
-                writer = side[1] # Get writer
-                try:
-                    writer.close() # Close writer
-                    logging.info("Closed writer")
-                except Exception:
-                    pass
-
-            elif hasattr(side, "close"): # socket style
-                try:
-                    side.close() # Close socket
-                except Exception:
-                    pass
-        except Exception:
-            pass
-       
-            
+        if isinstance(side, tuple): # asyncio style (reader, writer)
+            side = side[1]
+        transport = getattr(side, "transport", None)
+        if transport is not None:
+            transport.abort()
+        else: # socket style
+            side.close()
 
 def compare_cards(card1, card2):
     """
@@ -98,95 +144,353 @@ def compare_cards(card1, card2):
         return 1
     return 0
 
+def card_error(state, side, cmd, card):
+    """
+    Why a message from player `side` (0 or 1) is not a legal PLAYCARD in
+    this game, as one of ERROR_REASONS, or None if it is.
+    """
+    if cmd != Command.PLAYCARD.value:
+        return "not_playcard"
+    if card > 51:
+        return "card_out_of_range"
+    if not state.holds(side, card):
+        return "card_not_held"
+    if state.played(side, card):
+        return "card_repeated"
+    return None
+
+def card_mask(cards):
+    """
+    52-bit integer with bit n set for every card n in cards.
+    """
+    mask = 0
+    for card in cards:
+        mask |= 1 << card
+    return mask
+
+class GameState:
+    """
+    Cards of one game as 52-bit masks: the hand each player was dealt and
+    the cards each has played so far, plus the round count. A few ints in
+    __slots__ give every game the same small footprint, where a set per
+    hand grows with the cards in it.
+    """
+    __slots__ = ("hand1", "hand2", "used1", "used2", "rounds")
+
+    def __init__(self, hand1, hand2):
+        self.hand1 = card_mask(hand1)
+        self.hand2 = card_mask(hand2)
+        self.used1 = 0
+        self.used2 = 0
+        self.rounds = 0
+
+    def holds(self, side, card):
+        # Was card dealt to player `side` (0 or 1)?
+        return (self.hand2 if side else self.hand1) >> card & 1 == 1
+
+    def played(self, side, card):
+        return (self.used2 if side else self.used1) >> card & 1 == 1
+
+    def play(self, side, card):
+        if side:
+            self.used2 |= 1 << card
+        else:
+            self.used1 |= 1 << card
+
 def deal_cards():
     """
     TODO: Randomize a deck of cards (list of ints 0..51), and return two
     26 card "hands."
     """
+    if DEALS is not None:
+        hands = next(DEALS, None)
+        if hands is not None:
+            return hands
     deck = list(range(52))
     random.shuffle(deck)
     return deck[:26], deck[26:]
 
-async def play_one_game(p1, p2):
-    #TODO handle single game of war between two clients
-    r1, w1 = p1 #Player 1 read write
-    r2, w2 = p2 #Player 2 read write
+class Timer:
+    """
+    One scheduled callback on a TimerWheel: the tick it is due and its slot.
+    """
+    __slots__ = ("when", "slot", "callback")
 
-    #Game loop
-    try:
-        #Wait for players to want game
-        (m1, m2) = await asyncio.gather(r1.readexactly(2), r2.readexactly(2))
+class TimerWheel:
+    """
+    Hashed timer wheel: TIMER_SLOTS buckets of TIMER_TICK seconds, advanced
+    by a single event loop callback per tick while any timer is pending.
+    Scheduling and cancelling are O(1) set operations whatever the number
+    of timers, where call_later pushes every timeout onto the loop's heap
+    and leaves cancelled ones there. A tick only looks at one bucket.
+    """
+
+    def __init__(self, loop, tick=TIMER_TICK, slots=TIMER_SLOTS):
+        self.loop = loop
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.origin = loop.time()
+        self.now = 0 # ticks since origin that have been processed
+        self.count = 0
+        self.handle = None
 
-        #Check valid WANTGAME
-        if not (m1[0] == Command.WANTGAME.value and m1[1] == 0):
-            logging.error("bad WANTGAME from p1")
-            kill_game(Game(r1, r2), (r2, w2))
+    def schedule(self, delay, callback):
+        """
+        Call callback() after delay seconds (rounded up to a tick). Returns
+        a Timer for cancel(), or None if delay is None.
+        """
+        if delay is None:
+            return None
+        elapsed = self.loop.time() - self.origin
+        if self.handle is None:
+            # Idle wheel: catch the clock up before placing the timer
+            self.now = int(elapsed / self.tick)
+            self.handle = self.loop.call_at(self.next_tick(), self.advance)
+        timer = Timer()
+        # The first tick at or after the deadline, measured from the loop's
+        # clock rather than the last processed tick, which may lag behind it
+        timer.when = max(self.now + 1, -int(-(elapsed + delay) // self.tick))
+        timer.slot = timer.when % len(self.slots)
+        timer.callback = callback
+        self.slots[timer.slot].add(timer)
+        self.count += 1
+        return timer
+
+    def cancel(self, timer):
+        if timer is None:
             return
-        if not (m2[0] == Command.WANTGAME.value and m2[1] == 0):
-           logging.error("bad WANTGAME from p2")
-           kill_game(Game(r1, r2), (r2, w2))
-           return
+        slot = self.slots[timer.slot]
+        if timer in slot:
+            slot.remove(timer)
+            self.count -= 1
 
-        hand1, hand2 = deal_cards() #Deal cards to players
+    def advance(self):
+        # Run every tick up to now, including any missed while the loop was busy
+        target = int((self.loop.time() - self.origin) / self.tick)
+        while self.now < target:
+            self.now += 1
+            slot = self.slots[self.now % len(self.slots)]
+            if not slot:
+                continue
+            # Timers a full turn or more away stay in the bucket
+            due = [t for t in slot if t.when <= self.now]
+            for timer in due:
+                slot.remove(timer)
+            self.count -= len(due)
+            for timer in due:
+                try:
+                    timer.callback()
+                except Exception:
+                    logging.exception("timer callback failed")
+        self.handle = self.loop.call_at(self.next_tick(), self.advance) if self.count else None
 
-        # Send GAMESTART and hands
-        w1.write(bytes([Command.GAMESTART.value]) + bytes(hand1))
-        w2.write(bytes([Command.GAMESTART.value]) + bytes(hand2))
-        await asyncio.gather(w1.drain(), w2.drain()) 
+    def next_tick(self):
+        # Loop time the tick after the last processed one starts
+        return self.origin + (self.now + 1) * self.tick
 
-        hand1_set, hand2_set = set(hand1), set(hand2)
-        used1, used2 = set(), set()
+class Metrics:
+    """
+    Server counters for the metrics listener. They are plain ints bumped in
+    place: the event loop runs in one thread, so no locks are needed, and a
+    round costs an increment rather than a log line. sample_forever() turns
+    them into rates and measures event loop lag once per METRICS_INTERVAL.
+    """
+    __slots__ = ("games_started", "games_ended", "games_completed", "rounds", "errors",
+                 "games_rate", "rounds_rate", "lag", "max_lag", "admitted", "shed",
+                 "handshaking", "accept_paused", "accept_pauses")
 
-        # Play 26 rounds
+    def __init__(self):
+        self.games_started = 0
+        self.games_ended = 0 # completed or not; active games are started - ended
+        self.games_completed = 0
+        self.rounds = 0
+        self.errors = dict.fromkeys(ERROR_REASONS, 0)
+        self.games_rate = 0.0
+        self.rounds_rate = 0.0
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.admitted = 0
+        self.shed = {"games": 0, "waiting": 0} # connections shed, by the limit they hit
+        self.handshaking = 0 # admitted connections that have not sent WANTGAME yet
+        self.accept_paused = False
+        self.accept_pauses = 0
 
-        for _ in range(26): 
-            # Wait for PLAYCARD from players
-            (cmsg1, cmsg2) = await asyncio.gather(r1.readexactly(2), r2.readexactly(2))
+    def error(self, reason):
+        self.errors[reason] += 1
 
-            # Check valid PLAYCARD protocol
-            if cmsg1[0] != Command.PLAYCARD.value:
-                logging.error("expected PLAYCARD from p1")
-                kill_game(Game(r1, w1), (r2, w2))
-                return
-            if cmsg2[0] != Command.PLAYCARD.value:
-                logging.error("expected PLAYCARD from p2")
-                kill_game(Game(r1, w1), (r2, w2))
-                return
-            c1, c2 = cmsg1[1], cmsg2[1] #Cards played
+    def admit(self):
+        """
+        Admission control for a new connection: counts it and returns None
+        if it may stay, or the limit it hit ("games" or "waiting") if it
+        has to be shed.
+        """
+        if MAX_GAMES is not None and self.games_started - self.games_ended >= MAX_GAMES:
+            limit = "games"
+        elif MAX_WAITING is not None and self.handshaking + len(WAITING) >= MAX_WAITING:
+            limit = "waiting"
+        else:
+            self.admitted += 1
+            self.handshaking += 1
+            return None
+        self.shed[limit] += 1
+        return limit
 
-            # Validate cards by game rules
-            if not (0 <= c1 <= 51):
-                logging.error("p1 card out of range: %d", c1)
-                kill_game(Game((r1, w1), (r2, w2)))
-                return
+    async def sample_forever(self, interval=METRICS_INTERVAL):
+        # A sleep that wakes up late measures how long callbacks held the loop
+        loop = asyncio.get_running_loop()
+        games, rounds = self.games_completed, self.rounds
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            elapsed = loop.time() - start
+            self.lag = max(0.0, elapsed - interval)
+            self.max_lag = max(self.max_lag, self.lag)
+            self.games_rate = (self.games_completed - games) / elapsed
+            self.rounds_rate = (self.rounds - rounds) / elapsed
+            games, rounds = self.games_completed, self.rounds
 
-            if not (0 <= c2 <= 51):
-                logging.error("p2 card out of range: %d", c2)
-                kill_game(Game((r1, w1), (r2, w2)))
-                return
+    def render(self):
+        """
+        The metrics in the Prometheus text exposition format.
+        """
+        lines = []
 
-            if c1 not in hand1_set:
-                logging.error("p1 played non-hand card: %d", c1)
-                kill_game(Game((r1, w1), (r2, w2)))
-                return
+        def metric(name, kind, text, samples):
+            lines.append(f"# HELP war_{name} {text}")
+            lines.append(f"# TYPE war_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"war_{name}{labels} {value}")
 
-            if c2 not in hand2_set:
-                logging.error("p2 played non-hand card: %d", c2)
-                kill_game(Game((r1, w1), (r2, w2)))
-                return
+        matched = WAITING.stats()
+        metric("active_games", "gauge", "Games in progress.",
+               [("", self.games_started - self.games_ended)])
+        metric("waiting_clients", "gauge", "Clients waiting for an opponent.",
+               [("", matched["depth"])])
+        metric("connecting_clients", "gauge", "Admitted clients yet to send WANTGAME.",
+               [("", self.handshaking)])
+        metric("connections_total", "counter", "Connections admitted or shed at a limit.",
+               [('{outcome="admitted"}', self.admitted)] +
+               [(f'{{outcome="shed_{limit}"}}', count) for limit, count in self.shed.items()])
+        metric("accept_paused", "gauge", "1 while accepting is paused for loop lag.",
+               [("", int(self.accept_paused))])
+        metric("accept_pauses_total", "counter", "Times accepting was paused for loop lag.",
+               [("", self.accept_pauses)])
+        metric("games_started_total", "counter", "Games dealt.", [("", self.games_started)])
+        metric("games_completed_total", "counter", "Games that played all 26 rounds.",
+               [("", self.games_completed)])
+        metric("rounds_total", "counter", "Rounds scored.", [("", self.rounds)])
+        metric("games_per_second", "gauge", "Games completed per second, last interval.",
+               [("", f"{self.games_rate:.1f}")])
+        metric("rounds_per_second", "gauge", "Rounds scored per second, last interval.",
+               [("", f"{self.rounds_rate:.1f}")])
+        metric("protocol_errors_total", "counter", "Games and clients closed, by reason.",
+               [(f'{{reason="{reason}"}}', count) for reason, count in self.errors.items()])
+        metric("matchmaker_total", "counter", "Waiting clients paired or dropped.",
+               [(f'{{outcome="{key}"}}', matched[key])
+                for key in ("paired", "disconnected", "timed_out", "handed_off")])
+        metric("loop_lag_seconds", "gauge", "Event loop lag, last interval.",
+               [("", f"{self.lag:.6f}")])
+        metric("loop_lag_max_seconds", "gauge", "Largest event loop lag seen.",
+               [("", f"{self.max_lag:.6f}")])
+        return "\n".join(lines) + "\n"
 
-            if c1 in used1:
-                logging.error("p1 repeated a card: %d", c1)
-                kill_game(Game((r1, w1), (r2, w2)))
-                return
+METRICS = Metrics()
 
-            if c2 in used2:
-                logging.error("p2 repeated a card: %d", c2)
-                kill_game(Game((r1, w1), (r2, w2)))
+# The running server's war_record.Recorder while RECORD_PATH is set
+RECORDER = None
+
+TIMERS = None
+
+def timer_wheel():
+    """
+    The running loop's TimerWheel, made on first use.
+    """
+    global TIMERS
+    loop = asyncio.get_running_loop()
+    if TIMERS is None or TIMERS.loop is not loop:
+        TIMERS = TimerWheel(loop)
+    return TIMERS
+
+def round_timeout(deadline):
+    """
+    Seconds the next round may take: MESSAGE_TIMEOUT, cut short by the
+    game's deadline (a loop time, or None).
+    """
+    if deadline is None:
+        return MESSAGE_TIMEOUT
+    left = max(0.0, deadline - asyncio.get_running_loop().time())
+    return left if MESSAGE_TIMEOUT is None else min(MESSAGE_TIMEOUT, left)
+
+async def play_one_game(p1, p2, waited=0.0):
+    #TODO handle single game of war between two clients
+    r1, w1 = p1 #Player 1 read write
+    r2, w2 = p2 #Player 2 read write
+
+    game = Game(p1, p2)
+
+    # A round that overruns its deadline aborts both players, which ends
+    # whichever readexactly is waiting with IncompleteReadError
+    wheel = timer_wheel()
+    deadline = None if GAME_TIMEOUT is None else wheel.loop.time() + GAME_TIMEOUT
+    timer = None
+    state = None
+    expired = False
+    rec = RECORDER
+    clock = wheel.loop.time # times recorded rounds
+    gid = None
+    outcome = None # why the game ended early
+
+    def expire():
+        nonlocal expired
+        logging.debug("game timed out")
+        expired = True
+        kill_game(game)
+
+    #Game loop (both WANTGAMEs were already read by handle_client)
+    try:
+        hand1, hand2 = deal_cards() #Deal cards to players
+
+        # Send GAMESTART and hands; 27 bytes each never need a drain
+        w1.write(gamestart(hand1))
+        w2.write(gamestart(hand2))
+
+        state = GameState(hand1, hand2)
+        METRICS.games_started += 1
+        if rec is not None:
+            gid = rec.game(hand1, hand2, waited)
+            began = clock()
+
+        # Play 26 rounds
+
+        for _ in range(26): 
+            # Wait for PLAYCARD from players. The round needs both, so read them
+            # in turn rather than wrapping each read in a gather task
+            timer = wheel.schedule(round_timeout(deadline), expire)
+            cmsg1 = await r1.readexactly(2)
+            if rec is not None:
+                t1 = clock()
+            cmsg2 = await r2.readexactly(2)
+            if rec is not None:
+                # Not before p1's card was read: p2's may have come in earlier,
+                # so its recorded delay includes p1's (see war_record.Recorder)
+                t2 = clock()
+            wheel.cancel(timer)
+
+            # Check valid PLAYCARD protocol and cards by game rules. Errors are
+            # counted in METRICS rather than logged, so a flood of bad
+            # messages costs a counter and an abort each
+            c1, c2 = cmsg1[1], cmsg2[1] #Cards played
+            reason = card_error(state, 0, cmsg1[0], c1) or card_error(state, 1, cmsg2[0], c2)
+            if reason is not None:
+                logging.debug("game killed: %s", reason)
+                METRICS.error(reason)
+                outcome = reason
+                kill_game(game)
                 return
 
             #Compare cards and send results
-            used1.add(c1); used2.add(c2)
+            state.play(0, c1); state.play(1, c2)
+            state.rounds += 1
             cmpv = compare_cards(c1, c2)  
             if cmpv > 0:
                 rsl1, rsl2 = Result.WIN.value,  Result.LOSE.value
@@ -195,37 +499,402 @@ async def play_one_game(p1, p2):
             else:
                 rsl1 = rsl2 = Result.DRAW.value
 
-            w1.write(bytes([Command.PLAYRESULT.value, rsl1]))
-            w2.write(bytes([Command.PLAYRESULT.value, rsl2]))
-            await asyncio.gather(w1.drain(), w2.drain())
+            w1.write(PLAYRESULT[rsl1])
+            w2.write(PLAYRESULT[rsl2])
+            METRICS.rounds += 1
+            if rec is not None:
+                rec.round(gid, state.rounds, c1, c2, t1 - began, t2 - began)
+                began = t2
+            # Only wait on drain once a slow reader lets results pile up
+            if (w1.transport.get_write_buffer_size() > DRAIN_THRESHOLD
+                    or w2.transport.get_write_buffer_size() > DRAIN_THRESHOLD):
+                await asyncio.gather(w1.drain(), w2.drain())
+        METRICS.games_completed += 1
 
     # Handle disconnects and errors
     except (asyncio.IncompleteReadError, ConnectionResetError, OSError, RuntimeError) as e:
-        logging.error(f"Game aborted: {e}")
-        kill_game(Game((r1, w1), (r2, w2)))
-        return
+        logging.debug("Game aborted: %s", e)
+        outcome = "timeout" if expired else "disconnect"
+        METRICS.error(outcome)
+        kill_game(game)
 
-
-    # Ensure sockets are closed
+    # Ensure sockets are closed. close() flushes the last results of a
+    # finished game and is a no-op after kill_game; nothing waits on
+    # wait_closed, the transports finish closing on their own
     finally:
-        try:
-            w1.close(); w2.close() #Close writers
-            await asyncio.gather(w1.wait_closed(), w2.wait_closed())
-            kill_game(Game((r1, w1), (r2, w2)))
-            return
-        except Exception:
-            pass
+        wheel.cancel(timer)
+        if state is not None:
+            METRICS.games_ended += 1
+            if gid is not None:
+                if outcome is None and state.rounds < 26:
+                    outcome = "stopped"
+                rec.end(gid, state.rounds, outcome)
+        w1.close(); w2.close() #Close writers
+
+def connected(reader, writer):
+    """
+    True unless the client has hung up: its transport is closing, it has
+    sent EOF with nothing left to read, or the connection failed.
+    """
+    return not (writer.is_closing() or reader.at_eof() or reader.exception() is not None)
+
+class Matchmaker:
+    """
+    FIFO queue of clients waiting for an opponent. Each new client is paired
+    with the oldest live waiting client in O(1) (deque.popleft). Clients that
+    hung up while waiting are skipped and closed instead of being dealt into
+    a dead game. sweep() drops clients that waited longer than max_wait and
+    keeps the queue free of disconnected ones between arrivals.
+    """
+
+    def __init__(self, max_wait=MAX_WAIT):
+        self.max_wait = max_wait
+        self.queue = deque()
+        self.paired = 0
+        self.disconnected = 0
+        self.timed_out = 0
+        self.handed_off = 0
+        self.peak_depth = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def add(self, reader, writer):
+        """
+        Queue a new client. Returns (p1, p2, waited) to start a game with,
+        waited being the seconds p1 spent in the queue, or None if the
+        client has to wait.
+        """
+        now = asyncio.get_running_loop().time()
+        while self.queue:
+            r, w, since = self.queue.popleft()
+            if connected(r, w):
+                self.paired += 1
+                return (r, w), (reader, writer), now - since
+            self.disconnected += 1
+            w.close()
+        self.queue.append((reader, writer, now))
+        if len(self.queue) > self.peak_depth:
+            self.peak_depth = len(self.queue)
+        return None
+
+    def remove(self, writer):
+        # Take writer's client out of the queue; False if it is no longer waiting
+        for entry in self.queue:
+            if entry[1] is writer:
+                self.queue.remove(entry)
+                return True
+        return False
+
+    def sweep(self):
+        # Close and forget waiting clients that timed out or went away
+        if self.max_wait is not None:
+            deadline = asyncio.get_running_loop().time() - self.max_wait
+            # Oldest first, so expired clients are all at the left
+            while self.queue and self.queue[0][2] < deadline:
+                _, w, _ = self.queue.popleft()
+                self.timed_out += 1
+                w.close()
+        if any(not connected(r, w) for r, w, _ in self.queue):
+            live = deque()
+            for r, w, since in self.queue:
+                if connected(r, w):
+                    live.append((r, w, since))
+                else:
+                    self.disconnected += 1
+                    w.close()
+            self.queue = live
+
+    async def sweep_forever(self, interval=SWEEP_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            self.sweep()
+            logging.debug("waiting %d (peak %d), paired %d, disconnected %d, timed out %d",
+                          len(self.queue), self.peak_depth, self.paired,
+                          self.disconnected, self.timed_out)
+
+    def stats(self):
+        return {"depth": len(self.queue), "peak_depth": self.peak_depth,
+                "paired": self.paired, "disconnected": self.disconnected,
+                "timed_out": self.timed_out, "handed_off": self.handed_off}
+
+WAITING = Matchmaker()
 
 async def handle_client(reader, writer):
+    # Past a limit, close before doing any work for the connection
+    if METRICS.admit() is not None:
+        writer.transport.abort()
+        return
     peer = writer.get_extra_info("peername") # Get client address
     logging.info(f"client connected: {peer}")
-    # Add to waiting list
-    WAITING.append((reader, writer))
-    # Start game if more than 2 clients
-    if len(WAITING) >= 2:
-        p1 = WAITING.pop(0)
-        p2 = WAITING.pop(0)
-        asyncio.create_task(play_one_game(p1, p2))
+    # Read WANTGAME before queueing: only clients that asked for a game are
+    # paired, and a waiting client's buffer is empty so a hang-up shows as EOF
+    def idle():
+        METRICS.error("timeout")
+        writer.close()
+
+    wheel = timer_wheel()
+    timer = wheel.schedule(MESSAGE_TIMEOUT, idle)
+    try:
+        msg = await reader.readexactly(2)
+    except (asyncio.IncompleteReadError, OSError):
+        writer.close()
+        return
+    finally:
+        wheel.cancel(timer)
+        METRICS.handshaking -= 1
+    if msg != bytes([Command.WANTGAME.value, 0]):
+        logging.debug("bad WANTGAME from %s", peer)
+        METRICS.error("bad_wantgame")
+        writer.close()
+        return
+    enqueue(reader, writer)
+    if HANDOFF is not None:
+        asyncio.get_running_loop().call_later(HANDOFF_DELAY, hand_off, reader, writer)
+
+def enqueue(reader, writer):
+    # Pair with the oldest live waiting client, or wait for the next one
+    pair = WAITING.add(reader, writer)
+    if pair is None:
+        return
+    p1, p2, waited = pair
+    if isinstance(writer, WarProtocol):
+        ProtocolGame(p1[1], p2[1], waited)
+    else:
+        asyncio.create_task(play_one_game(p1, p2, waited))
+
+def hand_off(reader, writer):
+    """
+    Still no opponent in this worker: pass the connection's file descriptor
+    to the lobby worker, which pairs clients left over by all the workers.
+    """
+    if not WAITING.remove(writer):
+        return
+    sock = writer.get_extra_info("socket")
+    try:
+        socket.send_fds(HANDOFF, [b"\0"], [sock.fileno()])
+    except OSError as e:
+        logging.error("hand-off failed, keeping client: %s", e)
+        enqueue(reader, writer)
+        return
+    WAITING.handed_off += 1
+    # The lobby now holds its own copy of the descriptor
+    writer.transport.abort()
+
+def adopt_handoffs(lobby):
+    # Lobby worker: queue the connections handed over by the other workers
+    while True:
+        try:
+            _, fds, _, _ = socket.recv_fds(lobby, 1, 16)
+        except BlockingIOError:
+            return
+        for fd in fds:
+            asyncio.create_task(adopt(socket.socket(fileno=fd)))
+
+async def adopt(sock):
+    # Their WANTGAME was already read by the worker that accepted them
+    if ENGINE == "protocol":
+        loop = asyncio.get_running_loop()
+        _, proto = await loop.connect_accepted_socket(lambda: WarProtocol(wanted=True), sock)
+        enqueue(proto, proto)
+        return
+    reader, writer = await asyncio.open_connection(sock=sock)
+    enqueue(reader, writer)
+
+
+class WarProtocol(asyncio.Protocol):
+    """
+    One client connection in the protocol engine. Messages are parsed in
+    data_received and applied to the connection's ProtocolGame directly, so
+    a round costs no coroutines, futures or readexactly calls. It also acts
+    as both the "reader" and the "writer" of a player queued in WAITING.
+    """
+    __slots__ = ("transport", "game", "side", "buf", "wanted", "timer", "admitted")
+
+    def __init__(self, wanted=False):
+        self.transport = None
+        self.game = None
+        self.side = 0
+        self.buf = b""
+        self.wanted = wanted # WANTGAME already received
+        self.timer = None
+        self.admitted = False # counted in METRICS.handshaking until WANTGAME
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if not self.wanted:
+            # Past a limit, close before doing any work for the connection
+            if METRICS.admit() is not None:
+                transport.abort()
+                return
+            self.admitted = True
+            self.timer = timer_wheel().schedule(MESSAGE_TIMEOUT, self.idle)
+
+    def data_received(self, data):
+        # Every client message is 2 bytes; keep an odd trailing byte for later
+        if self.buf:
+            data = self.buf + data
+        end = len(data) & ~1
+        for i in range(0, end, 2):
+            if self.transport.is_closing():
+                return
+            if self.game is not None:
+                self.game.play(self.side, data[i], data[i + 1])
+            elif not self.wanted and data[i] == Command.WANTGAME.value and data[i + 1] == 0:
+                self.wanted = True
+                METRICS.handshaking -= 1
+                timer_wheel().cancel(self.timer)
+                self.timer = None
+                enqueue(self, self)
+                if HANDOFF is not None:
+                    asyncio.get_running_loop().call_later(HANDOFF_DELAY, hand_off, self, self)
+            else:
+                logging.debug("unexpected message while waiting for a game")
+                METRICS.error("bad_wantgame")
+                self.close()
+                return
+        self.buf = data[end:]
+
+    def connection_lost(self, exc):
+        timer_wheel().cancel(self.timer)
+        if self.admitted and not self.wanted:
+            METRICS.handshaking -= 1
+        if self.game is not None:
+            self.game.kill("disconnect")
+
+    # What Matchmaker and hand_off use on a (reader, writer) pair
+
+    def at_eof(self):
+        return self.transport.is_closing()
+
+    def exception(self):
+        return None
+
+    def is_closing(self):
+        return self.transport.is_closing()
+
+    def get_extra_info(self, name, default=None):
+        return self.transport.get_extra_info(name, default)
+
+    def close(self):
+        self.transport.close()
+
+    def idle(self):
+        # No WANTGAME within MESSAGE_TIMEOUT
+        METRICS.error("timeout")
+        self.close()
+
+
+class ProtocolGame:
+    """
+    One game in the protocol engine, advanced by WarProtocol as PLAYCARD
+    messages arrive. A round is scored once both players have a card in,
+    and the results are written without waiting on drain. Each player may
+    have at most one card waiting for the opponent's (card1/card2, -1 for
+    none); sending a second one before its result is a protocol error.
+    A single timer per game enforces the round and game deadlines. While
+    RECORDER is set, rec is it, gid is the game's id in the log and t1/t2 the
+    loop times the round's cards arrived (otherwise gid is None).
+    """
+    __slots__ = ("p1", "p2", "state", "card1", "card2", "deadline", "timer",
+                 "rec", "clock", "gid", "began", "t1", "t2")
+
+    def __init__(self, p1, p2, waited=0.0):
+        self.p1 = p1
+        self.p2 = p2
+        p1.game, p1.side = self, 0
+        p2.game, p2.side = self, 1
+        hand1, hand2 = deal_cards()
+        self.state = GameState(hand1, hand2)
+        self.card1 = self.card2 = -1
+        wheel = timer_wheel()
+        self.deadline = None if GAME_TIMEOUT is None else wheel.loop.time() + GAME_TIMEOUT
+        self.timer = wheel.schedule(round_timeout(self.deadline), self.expire)
+        METRICS.games_started += 1
+        self.rec = RECORDER
+        self.clock = wheel.loop.time
+        self.gid = None
+        if self.rec is not None:
+            self.gid = self.rec.game(hand1, hand2, waited)
+            self.began = self.t1 = self.t2 = self.clock()
+        p1.transport.write(gamestart(hand1))
+        p2.transport.write(gamestart(hand2))
+
+    def play(self, side, cmd, card):
+        state = self.state
+        reason = card_error(state, side, cmd, card)
+        if reason is None and (self.card2 if side else self.card1) != -1:
+            reason = "played_twice"
+        if reason is not None:
+            self.kill(reason)
+            return
+        state.play(side, card)
+        if side:
+            self.card2 = card
+        else:
+            self.card1 = card
+        if self.gid is not None:
+            if side:
+                self.t2 = self.clock()
+            else:
+                self.t1 = self.clock()
+        if self.card1 == -1 or self.card2 == -1:
+            return
+        cmpv = compare_cards(self.card1, self.card2)
+        if self.gid is not None:
+            self.rec.round(self.gid, state.rounds + 1, self.card1, self.card2,
+                             self.t1 - self.began, self.t2 - self.began)
+            self.began = max(self.t1, self.t2)
+        self.card1 = self.card2 = -1
+        if cmpv > 0:
+            rsl1, rsl2 = Result.WIN.value, Result.LOSE.value
+        elif cmpv < 0:
+            rsl1, rsl2 = Result.LOSE.value, Result.WIN.value
+        else:
+            rsl1 = rsl2 = Result.DRAW.value
+        self.p1.transport.write(PLAYRESULT[rsl1])
+        self.p2.transport.write(PLAYRESULT[rsl2])
+        state.rounds += 1
+        METRICS.rounds += 1
+        if state.rounds == 26:
+            METRICS.games_completed += 1
+            self.close()
+            return
+        wheel = timer_wheel()
+        wheel.cancel(self.timer)
+        self.timer = wheel.schedule(round_timeout(self.deadline), self.expire)
+
+    def expire(self):
+        self.timer = None
+        self.kill("timeout")
+
+    def kill(self, reason):
+        # Protocol error, timeout or hang-up: count it and drop both players
+        logging.debug("game killed: %s", reason)
+        METRICS.error(reason)
+        self.close(reason)
+
+    def close(self, reason=None):
+        """
+        End the game once, however often it is called: flush what was
+        written and disconnect both players, or if it ended for `reason`
+        (one of ERROR_REASONS) drop them at once like kill_game.
+        """
+        if self.p1.game is not self:
+            return # already closed
+        METRICS.games_ended += 1
+        if self.gid is not None:
+            if reason is None and self.state.rounds < 26:
+                reason = "stopped"
+            self.rec.end(self.gid, self.state.rounds, reason)
+        timer_wheel().cancel(self.timer)
+        self.timer = None
+        for player in (self.p1, self.p2):
+            player.game = None
+            if reason is None:
+                player.transport.close()
+            else:
+                player.transport.abort()
 
 
 async def serve_game(host, port):
@@ -234,12 +903,92 @@ async def serve_game(host, port):
     perform the war protocol to serve a game of war between each client.
     This function should run forever, continually serving clients.
     """
-    # Use asyncio start_server to handle clients
-    server = await asyncio.start_server(handle_client, host, port, backlog=1024)
+    server = await listen(host, port)
+    await serve_forever(server)
+
+async def listen(host, port, **kwargs):
+    # Use asyncio start_server (or create_server for the protocol engine) to handle clients
+    if ENGINE == "protocol":
+        loop = asyncio.get_running_loop()
+        return await loop.create_server(WarProtocol, host, port, backlog=1024, **kwargs)
+    return await asyncio.start_server(handle_client, host, port, backlog=1024, **kwargs)
+
+async def serve_forever(server):
+    global RECORDER
     addrs = ", ".join(str(s.getsockname()) for s in server.sockets) # Get server addresses
     logging.info(f"server listening on {addrs}")
-    async with server:
-        await server.serve_forever()
+    tasks = [asyncio.create_task(WAITING.sweep_forever())]
+    if METRICS_PORT is not None:
+        metrics = await asyncio.start_server(handle_metrics, "127.0.0.1", METRICS_PORT)
+        logging.info("metrics on http://127.0.0.1:%d/", METRICS_PORT)
+        tasks.append(asyncio.create_task(METRICS.sample_forever()))
+        tasks.append(asyncio.create_task(metrics.serve_forever()))
+    if RECORD_PATH is not None:
+        # Recording lives apart (war_record), so unrecorded runs need no struct
+        import war_record
+        RECORDER = war_record.Recorder(RECORD_PATH)
+        logging.info("recording games to %s", RECORD_PATH)
+        tasks.append(asyncio.create_task(RECORDER.flush_forever()))
+    if MAX_LAG is not None:
+        tasks.append(asyncio.create_task(throttle_accept(server)))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        for task in tasks:
+            task.cancel()
+        logging.info("admitted %d connections, shed %d at the game limit and %d at the waiting limit",
+                     METRICS.admitted, METRICS.shed["games"], METRICS.shed["waiting"])
+        if RECORDER is not None:
+            RECORDER.close()
+            RECORDER = None
+
+async def throttle_accept(server, interval=LAG_CHECK_INTERVAL):
+    """
+    Stop accepting connections while the event loop lags MAX_LAG or more
+    behind and start again once it is under MAX_LAG / 2, so new clients
+    wait in the kernel's listen backlog rather than add work to a loop that
+    cannot keep up. asyncio has no public way to pause a Server: this takes
+    its listening sockets out of the selector and puts them back with
+    Server._start_serving, so it only runs on selector event loops.
+    """
+    loop = asyncio.get_running_loop()
+    if not isinstance(loop, asyncio.selector_events.BaseSelectorEventLoop):
+        logging.info("accept throttling needs a selector event loop, not %s", type(loop).__name__)
+        return
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = loop.time() - start - interval
+        if not METRICS.accept_paused and lag >= MAX_LAG:
+            for sock in server.sockets:
+                loop.remove_reader(sock.fileno())
+            METRICS.accept_paused = True
+            METRICS.accept_pauses += 1
+            logging.warning("event loop %.3f s behind, pausing accept", lag)
+        elif METRICS.accept_paused and lag < MAX_LAG / 2:
+            server._serving = False
+            server._start_serving()
+            METRICS.accept_paused = False
+            logging.info("accepting again")
+
+async def handle_metrics(reader, writer):
+    """
+    Answer any HTTP request on the metrics port with METRICS.render().
+    """
+    try:
+        await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), MESSAGE_TIMEOUT)
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, OSError):
+        writer.close()
+        return
+    body = METRICS.render().encode()
+    writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                 b"Content-Length: %d\r\nConnection: close\r\n\r\n" % len(body) + body)
+    try:
+        await writer.drain()
+    except OSError:
+        pass
+    writer.close()
 
 async def limit_client(host, port, sem):
     """
@@ -249,20 +998,38 @@ async def limit_client(host, port, sem):
     async with sem:
         return await client(host, port)
 
-async def client(host, port):
+async def client(host, port, think=None, stats=None):
     """
     Run an individual client on a given event loop.
     You do not need to change this function.
+
+    For load testing (see war_load.py): `think`, if given, is called before
+    each card for a number of seconds to wait (laggy.py always waits 1).
+    `stats`, if given, gets stats.record(kind, seconds) for "connect",
+    "gamestart" (WANTGAME to GAMESTART) and every "rtt" (PLAYCARD to
+    PLAYRESULT), and stats.error(name) for each failure.
     """
+    clock = asyncio.get_running_loop().time
     try:
+        sent = clock()
         reader, writer = await asyncio.open_connection(host, port)
+        if stats is not None:
+            stats.record("connect", clock() - sent)
         # send want game
+        sent = clock()
         writer.write(b"\0\0")
         card_msg = await reader.readexactly(27)
+        if stats is not None:
+            stats.record("gamestart", clock() - sent)
         myscore = 0
         for card in card_msg[1:]:
+            if think is not None:
+                await asyncio.sleep(think())
+            sent = clock()
             writer.write(bytes([Command.PLAYCARD.value, card]))
             result = await reader.readexactly(2)
+            if stats is not None:
+                stats.record("rtt", clock() - sent)
             if result[1] == Result.WIN.value:
                 myscore += 1
             elif result[1] == Result.LOSE.value:
@@ -278,23 +1045,77 @@ async def client(host, port):
         return 1
     except ConnectionResetError:
         logging.error("ConnectionResetError")
+        if stats is not None:
+            stats.error("ConnectionResetError")
         return 0
-    except asyncio.streams.IncompleteReadError:
-        logging.error("asyncio.streams.IncompleteReadError")
+    except asyncio.IncompleteReadError:
+        logging.error("asyncio.IncompleteReadError")
+        if stats is not None:
+            stats.error("IncompleteReadError")
         return 0
-    except OSError:
+    except OSError as e:
         logging.error("OSError")
+        if stats is not None:
+            stats.error(type(e).__name__)
         return 0
 
+def install_uvloop():
+    """
+    Run every event loop created from here on with uvloop, if it is installed.
+    """
+    try:
+        import uvloop
+    except ImportError:
+        logging.error("uvloop is not installed, using the default event loop")
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+def option(args, name, default=None):
+    """
+    Value of an optional `--name value` flag after the positional arguments.
+    """
+    if name in args[3:]:
+        idx = args.index(name, 3)
+        if idx + 1 < len(args):
+            return args[idx + 1]
+    return default
+
 def main(args):
     """
     launch a client/server
+
+    server host port [--workers N] [--engine streams|protocol] [--uvloop]
+                     [--metrics PORT] [--record PATH] [--deals LOG]
+                     [--max-games N] [--max-waiting N] [--max-lag S]
     """
+    global ENGINE, METRICS_PORT, RECORD_PATH, DEALS, MAX_GAMES, MAX_WAITING, MAX_LAG
     host = args[1]
     port = int(args[2])
+    if "--uvloop" in args[3:]:
+        install_uvloop()
     if args[0] == "server":
+        ENGINE = option(args, "--engine", ENGINE)
+        if ENGINE not in ("streams", "protocol"):
+            logging.error("unknown engine %s", ENGINE)
+            return
+        workers = int(option(args, "--workers", 1))
+        if option(args, "--metrics") is not None:
+            METRICS_PORT = int(option(args, "--metrics"))
+        RECORD_PATH = option(args, "--record")
+        MAX_GAMES = int(option(args, "--max-games", MAX_GAMES))
+        MAX_WAITING = int(option(args, "--max-waiting", MAX_WAITING))
+        MAX_LAG = float(option(args, "--max-lag", MAX_LAG))
+        if option(args, "--deals") is not None:
+            import war_record
+            DEALS = war_record.recorded_deals(option(args, "--deals"))
         try:
-            asyncio.run(serve_game(host, port))
+            if workers > 1:
+                # The process pool lives apart, so plain runs need no multiprocessing
+                import war_workers
+                war_workers.serve_workers(host, port, workers)
+            else:
+                asyncio.run(serve_game(host, port))
         except KeyboardInterrupt:
             pass
         return
@@ -321,5 +1142,7 @@ def main(args):
     
 
 if __name__ == "__main__":
+    # So `import war` (war_workers) gets this module, not a second copy
+    sys.modules.setdefault("war", sys.modules[__name__])
     logging.basicConfig(level=logging.INFO)
     main(sys.argv[1:])
@@ -0,0 +1,520 @@
+"""
+Benchmarks for the war server.
+
+    python war_bench.py engines [games] [client_procs]
+    python war_bench.py state [games]
+    python war_bench.py timers
+    python war_bench.py fuzz [seconds] [players] [client_procs]
+    python war_bench.py record [games] [client_procs]
+    python war_bench.py storm [connections] [client_procs]
+
+`engines` runs the server in its own process with each engine (streams,
+protocol, and protocol on uvloop if it is installed) and plays `games`
+concurrent games against it (default 10000, i.e. 20000 connections). Client
+processes share the connections and use a small callback-based player, so
+they cost as little as possible. It reports rounds per second, and the
+server's CPU time per round, which does not depend on how fast the clients
+are.
+
+`state` uses tracemalloc to measure the bytes held per game by the old
+per-game state (a set per hand plus a set of used cards per player) and by
+war.GameState, at the deal and half way through a game.
+
+`timers` re-arms timeouts the way the server does every round (cancel one
+and schedule another) with 1k and 100k timers pending, once on
+war.TimerWheel and once with loop.call_later. It reports the cost per
+re-arm.
+
+`fuzz` floods each engine for `seconds` (default 10) with `players`
+connections at a time (default 500) that ask for a game and answer
+GAMESTART with one malformed message: a wrong command, a card out of
+range, a card they do not hold, a repeated card, garbage, or half a
+message and a hang-up. It reports the games the server dealt and tore
+down per second, its CPU time per game, and its error counts by reason.
+
+`record` runs `engines` on each engine with and without war_record.Recorder
+writing every game to a temporary file, RECORD_REPEATS times each way,
+and reports the server's best CPU time per round both ways and the log's
+size per game. The runs differ by more than recording costs on a busy
+machine, so it also times Recorder.round (plus the two clock reads a round
+takes) on its own, as a share of the plain CPU time per round.
+
+`storm` opens `connections` (default 18000) idle connections at once, none
+of which ever sends WANTGAME, first against a server with no admission
+limits and then with the default war.MAX_WAITING lowered to STORM_WAITING.
+It reports connections admitted and shed, and the server's peak RSS.
+"""
+import asyncio
+import logging
+import multiprocessing
+import random
+import socket
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import war
+import war_record
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+DEFAULT_GAMES = 10000
+DEFAULT_CLIENT_PROCS = 2
+DEFAULT_FUZZ_SECONDS = 10
+DEFAULT_FUZZ_PLAYERS = 500
+RECORD_REPEATS = 3
+DEFAULT_STORM = 18000
+STORM_WAITING = 2000
+# Seconds storm connections are held open before the counts are taken
+STORM_HOLD = 2.0
+# Seconds a fuzz player waits to be dropped, e.g. when left without an opponent
+FUZZ_WAIT = 2.0
+FUZZ_KINDS = ("command", "range", "not_held", "repeat", "garbage", "truncated")
+# Connects in flight per client process, so the listen backlog does not overflow
+CONNECT_LIMIT = 512
+
+
+def raise_fd_limit():
+    # Lift the soft open-file limit to the hard one; return the new limit
+    if resource is None:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+class BenchPlayer(asyncio.Protocol):
+    """
+    Plays its cards in the order dealt, sending the next one as each
+    PLAYRESULT arrives. Resolves `done` with True after all 26 results.
+    """
+
+    def __init__(self, done):
+        self.done = done
+        self.transport = None
+        self.buf = b""
+        self.hand = None
+        self.results = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.write(bytes([war.Command.WANTGAME.value, 0]))
+
+    def data_received(self, data):
+        buf = self.buf + data if self.buf else data
+        if self.hand is None:
+            if len(buf) < 27:
+                self.buf = buf
+                return
+            self.hand = buf[1:27]
+            buf = buf[27:]
+            self.transport.write(bytes([war.Command.PLAYCARD.value, self.hand[0]]))
+        got = len(buf) // 2
+        self.buf = buf[got * 2:]
+        for _ in range(got):
+            self.results += 1
+            if self.results < 26:
+                self.transport.write(bytes([war.Command.PLAYCARD.value, self.hand[self.results]]))
+        if self.results >= 26:
+            self.transport.close()
+
+    def connection_lost(self, exc):
+        if not self.done.done():
+            self.done.set_result(self.results == 26)
+
+
+def fuzz_message(kind, hand):
+    # One malformed answer to GAMESTART; `hand` is the 26 cards dealt
+    play = war.Command.PLAYCARD.value
+    if kind == "command":
+        return bytes([war.Command.WANTGAME.value, hand[0]])
+    if kind == "range":
+        return bytes([play, random.randrange(52, 256)])
+    if kind == "not_held":
+        return bytes([play, next(c for c in range(52) if c not in hand)])
+    if kind == "repeat":
+        # Legal in the first round, so the opponent has to play too
+        return bytes([play, hand[0], play, hand[0]])
+    if kind == "garbage":
+        return bytes(random.choice((0, 1, 3, 4, 255)) if i % 2 == 0 else random.randrange(256)
+                     for i in range(2 * random.randint(1, 8)))
+    return bytes([play]) # truncated, then hang up
+
+
+class FuzzPlayer(asyncio.Protocol):
+    """
+    Asks for a game and answers GAMESTART with fuzz_message(kind). Resolves
+    `done` with True once the server drops the connection.
+    """
+
+    def __init__(self, done, kind):
+        self.done = done
+        self.kind = kind
+        self.transport = None
+        self.buf = b""
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.write(bytes([war.Command.WANTGAME.value, 0]))
+
+    def data_received(self, data):
+        if self.buf is None:
+            return
+        self.buf += data
+        if len(self.buf) < 27:
+            return
+        self.transport.write(fuzz_message(self.kind, self.buf[1:27]))
+        self.buf = None
+        if self.kind == "truncated":
+            self.transport.write_eof()
+
+    def connection_lost(self, exc):
+        if not self.done.done():
+            self.done.set_result(True)
+
+
+async def fuzz_many(port, players, seconds):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + seconds
+
+    async def player():
+        dropped = 0
+        while loop.time() < deadline:
+            done = loop.create_future()
+            try:
+                transport, _ = await loop.create_connection(
+                    lambda: FuzzPlayer(done, random.choice(FUZZ_KINDS)), "127.0.0.1", port)
+            except OSError:
+                await asyncio.sleep(0.01)
+                continue
+            try:
+                dropped += await asyncio.wait_for(done, FUZZ_WAIT)
+            except asyncio.TimeoutError:
+                transport.abort()
+        return dropped
+
+    return sum(await asyncio.gather(*[player() for _ in range(players)]))
+
+
+async def hold_idle(port, connections):
+    # Open `connections` that never speak and hold them for STORM_HOLD seconds
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(CONNECT_LIMIT)
+    transports = []
+
+    async def one():
+        async with sem:
+            try:
+                transport, _ = await loop.create_connection(asyncio.Protocol, "127.0.0.1", port)
+            except OSError:
+                return
+        transports.append(transport)
+
+    await asyncio.gather(*[one() for _ in range(connections)])
+    await asyncio.sleep(STORM_HOLD)
+    for transport in transports:
+        transport.abort()
+    return len(transports)
+
+
+async def play_many(port, connections):
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(CONNECT_LIMIT)
+
+    async def one():
+        done = loop.create_future()
+        async with sem:
+            try:
+                await loop.create_connection(lambda: BenchPlayer(done), "127.0.0.1", port)
+            except OSError:
+                return False
+        return await done
+
+    return sum(await asyncio.gather(*[one() for _ in range(connections)]))
+
+
+def client_proc(port, connections, start, conn, target, args):
+    # Child process: wait for the go signal, then run target(port, connections, *args)
+    raise_fd_limit()
+    random.seed()
+    start.wait()
+    conn.send(asyncio.run(target(port, connections, *args)))
+    conn.close()
+
+
+def server_proc(engine, use_uvloop, sock, stop, conn, record=None, settings=None):
+    # Child process: serve on the inherited socket until stop is set, then
+    # report its CPU time, peak RSS and war.METRICS. Records games to the
+    # file `record` if given; `settings` overrides war's module settings
+    raise_fd_limit()
+    logging.disable(logging.ERROR)
+    war.ENGINE = engine
+    for name, value in (settings or {}).items():
+        setattr(war, name, value)
+    if use_uvloop:
+        war.install_uvloop()
+
+    async def serve():
+        server = await war.listen(None, None, sock=sock)
+        if record is not None:
+            war.RECORDER = war_record.Recorder(record)
+        async with server:
+            cpu = time.process_time()
+            await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+            if war.RECORDER is not None:
+                war.RECORDER.close()
+            cpu = time.process_time() - cpu
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource is not None else 0
+        return {"cpu": cpu, "rss_kib": rss, "metrics": war.METRICS}
+
+    conn.send(asyncio.run(serve()))
+    conn.close()
+
+
+def run_clients(engine, use_uvloop, players, client_procs, target=None, args=(),
+                record=None, settings=None):
+    """
+    Start a server process and `client_procs` client processes sharing
+    `players` connections, each running target(port, its share, *args)
+    (play_many by default). Returns the clients' summed results, the
+    seconds they took and what server_proc reports.
+    """
+    ctx = multiprocessing.get_context("fork")
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    stop, start = ctx.Event(), ctx.Event()
+    server_recv, server_send = ctx.Pipe(duplex=False)
+    server = ctx.Process(target=server_proc,
+                         args=(engine, use_uvloop, sock, stop, server_send, record, settings))
+    server.start()
+    sock.close()
+
+    clients = []
+    for i in range(client_procs):
+        n = players // client_procs + (i < players % client_procs)
+        recv, send = ctx.Pipe(duplex=False)
+        proc = ctx.Process(target=client_proc, args=(port, n, start, send, target or play_many, args))
+        proc.start()
+        clients.append((proc, recv))
+
+    time.sleep(0.5)  # let the server start listening
+    began = time.perf_counter()
+    start.set()
+    total = sum(recv.recv() for _, recv in clients)
+    elapsed = time.perf_counter() - began
+    for proc, _ in clients:
+        proc.join()
+    stop.set()
+    result = server_recv.recv()
+    server.join()
+    return total, elapsed, result
+
+
+def run_engine(engine, use_uvloop, games, client_procs, record=None):
+    finished, elapsed, server = run_clients(engine, use_uvloop, 2 * games, client_procs,
+                                            record=record)
+    return finished // 2, elapsed, server["cpu"]
+
+
+def bench_engines(games=DEFAULT_GAMES, client_procs=DEFAULT_CLIENT_PROCS):
+    games = int(games)
+    client_procs = int(client_procs)
+    limit = raise_fd_limit()
+    if limit is not None and 2 * games + 64 > limit:
+        games = (limit - 64) // 2
+        print(f"open-file limit is {limit}, running {games} games")
+    print(f"{'engine':<16} {'games':>6} {'ok':>6} {'seconds':>8} {'rounds/s':>9} {'server us/round':>16}")
+    for engine, use_uvloop in engine_cases():
+        ok, elapsed, cpu = run_engine(engine, use_uvloop, games, client_procs)
+        rounds = ok * 26
+        name = engine + ("+uvloop" if use_uvloop else "")
+        per_round = cpu / rounds * 1e6 if rounds else float("nan")
+        print(f"{name:<16} {games:>6} {ok:>6} {elapsed:>8.2f} {rounds / elapsed:>9.0f} {per_round:>16.1f}")
+
+
+def engine_cases():
+    cases = [("streams", False), ("protocol", False)]
+    if uvloop is not None:
+        cases.append(("protocol", True))
+    return cases
+
+
+def bench_fuzz(seconds=DEFAULT_FUZZ_SECONDS, players=DEFAULT_FUZZ_PLAYERS,
+               client_procs=DEFAULT_CLIENT_PROCS):
+    seconds = float(seconds)
+    players = int(players)
+    client_procs = int(client_procs)
+    raise_fd_limit()
+    print(f"{'engine':<16} {'seconds':>8} {'games':>7} {'games/s':>8} {'server us/game':>15}  errors")
+    for engine, use_uvloop in engine_cases():
+        # Rates are over `seconds`: elapsed also counts the last FUZZ_WAIT
+        # of players left without an opponent
+        _, elapsed, server = run_clients(engine, use_uvloop, players, client_procs,
+                                         fuzz_many, (seconds,))
+        cpu, games, errors = server["cpu"], server["metrics"].games_started, server["metrics"].errors
+        name = engine + ("+uvloop" if use_uvloop else "")
+        per_game = cpu / games * 1e6 if games else float("nan")
+        counts = ", ".join(f"{reason} {count}" for reason, count in errors.items() if count)
+        print(f"{name:<16} {elapsed:>8.2f} {games:>7} {games / seconds:>8.0f} {per_game:>15.1f}  {counts}")
+
+
+def bench_record(games=DEFAULT_GAMES, client_procs=DEFAULT_CLIENT_PROCS):
+    games = int(games)
+    client_procs = int(client_procs)
+    limit = raise_fd_limit()
+    if limit is not None and 2 * games + 64 > limit:
+        games = (limit - 64) // 2
+        print(f"open-file limit is {limit}, running {games} games")
+    print(f"{'engine':<16} {'plain us/round':>15} {'recording':>10} {'overhead':>9}"
+          f" {'log B/game':>11} {'record us/round':>16}")
+    with tempfile.TemporaryDirectory() as tmp:
+        recorder = war_record.Recorder(os.path.join(tmp, "direct.log"))
+        calls = 200000
+        start = time.perf_counter()
+        for i in range(calls):
+            recorder.round(1, 1, 2, 3, time.monotonic(), time.monotonic())
+        direct = (time.perf_counter() - start) / calls * 1e6
+        recorder.close()
+        for engine, use_uvloop in engine_cases():
+            path = os.path.join(tmp, f"{engine}{use_uvloop:d}.log")
+            # Best of RECORD_REPEATS alternating runs: one run's noise is
+            # bigger than the cost being measured
+            per_round = [float("inf"), float("inf")]
+            for _ in range(RECORD_REPEATS):
+                for i, record in enumerate((None, path)):
+                    if record is not None and os.path.exists(record):
+                        os.remove(record)
+                    ok, _, cpu = run_engine(engine, use_uvloop, games, client_procs, record)
+                    if ok:
+                        per_round[i] = min(per_round[i], cpu / (ok * 26) * 1e6)
+            name = engine + ("+uvloop" if use_uvloop else "")
+            overhead = (per_round[1] / per_round[0] - 1) * 100
+            print(f"{name:<16} {per_round[0]:>15.1f} {per_round[1]:>10.1f} {overhead:>8.1f}%"
+                  f" {os.path.getsize(path) / games:>11.0f}"
+                  f" {direct:>8.2f} ({direct / per_round[0] * 100:.1f}%)")
+
+
+def bench_storm(connections=DEFAULT_STORM, client_procs=DEFAULT_CLIENT_PROCS):
+    connections = int(connections)
+    client_procs = int(client_procs)
+    limit = raise_fd_limit()
+    if limit is not None and connections + 64 > limit:
+        connections = limit - 64
+        print(f"open-file limit is {limit}, opening {connections} connections")
+    print(f"{'engine':<16} {'max waiting':>11} {'connected':>9} {'admitted':>9} {'shed':>6}"
+          f" {'server peak RSS MiB':>20}")
+    for engine, use_uvloop in engine_cases():
+        for max_waiting in (None, STORM_WAITING):
+            connected, _, server = run_clients(engine, use_uvloop, connections, client_procs,
+                                               hold_idle, settings={"MAX_WAITING": max_waiting})
+            metrics = server["metrics"]
+            name = engine + ("+uvloop" if use_uvloop else "")
+            print(f"{name:<16} {str(max_waiting):>11} {connected:>9} {metrics.admitted:>9}"
+                  f" {sum(metrics.shed.values()):>6} {server['rss_kib'] / 1024:>20.1f}")
+
+
+def set_state(hand1, hand2, played):
+    # Per-game state as play_one_game used to keep it
+    used1, used2 = set(hand1[:played]), set(hand2[:played])
+    return set(hand1), set(hand2), used1, used2
+
+
+def mask_state(hand1, hand2, played):
+    state = war.GameState(hand1, hand2)
+    for i in range(played):
+        state.play(0, hand1[i])
+        state.play(1, hand2[i])
+    state.rounds = played
+    return state
+
+
+def bytes_per_game(make, deals, played):
+    # Memory held by make(...) for every deal, per game
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    states = [make(h1, h2, played) for h1, h2 in deals]
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    # The list holding the states is not part of the per-game cost
+    return (held - sys.getsizeof(states)) / len(deals)
+
+
+def bench_state(games=100000):
+    games = int(games)
+    random.seed(1)
+    deals = [war.deal_cards() for _ in range(games)]
+    print(f"{'state':<12} {'round':>5} {'bytes/game':>11}")
+    for played in (0, 13):
+        for name, make in (("sets", set_state), ("GameState", mask_state)):
+            print(f"{name:<12} {played:>5} {bytes_per_game(make, deals, played):>11.0f}")
+
+
+async def rearm_cost(pending, use_wheel, ops=200000):
+    # Microseconds per cancel-and-reschedule with `pending` timers outstanding
+    loop = asyncio.get_running_loop()
+    wheel = war.TimerWheel(loop)
+
+    def noop():
+        pass
+
+    if use_wheel:
+        schedule, cancel = wheel.schedule, wheel.cancel
+    else:
+        schedule, cancel = loop.call_later, asyncio.TimerHandle.cancel
+    timers = [schedule(30 + i % 1000 * 0.01, noop) for i in range(pending)]
+    elapsed = 0.0
+    for batch in range(0, ops, 1000):
+        start = time.perf_counter()
+        for i in range(batch, batch + 1000):
+            j = i % pending
+            cancel(timers[j])
+            timers[j] = schedule(30, noop)
+        elapsed += time.perf_counter() - start
+        # Let the loop run, as it would between rounds (and purge cancelled handles)
+        await asyncio.sleep(0)
+    for timer in timers:
+        cancel(timer)
+    if wheel.handle is not None:
+        wheel.handle.cancel()
+    return elapsed / ops * 1e6
+
+
+def bench_timers():
+    print(f"{'timers':<12} {'pending':>8} {'us/re-arm':>10}")
+    for pending in (1000, 100000):
+        for name, use_wheel in (("call_later", False), ("TimerWheel", True)):
+            cost = asyncio.run(rearm_cost(pending, use_wheel))
+            print(f"{name:<12} {pending:>8} {cost:>10.3f}")
+
+
+def main(args):
+    if not args or args[0] == "engines":
+        bench_engines(*args[1:3])
+    elif args[0] == "state":
+        bench_state(*args[1:2])
+    elif args[0] == "timers":
+        bench_timers()
+    elif args[0] == "fuzz":
+        bench_fuzz(*args[1:4])
+    elif args[0] == "record":
+        bench_record(*args[1:3])
+    elif args[0] == "storm":
+        bench_storm(*args[1:3])
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,245 @@
+"""
+Load generator for capacity planning the war server.
+
+    python war_load.py HOST PORT [--duration S] [--concurrency N | --rate R]
+                       [--procs P] [--think SPEC] [--max-outstanding N]
+
+Every player is war.client, spread over P processes. With --concurrency
+(closed loop) each process keeps N/P players in games back to back until
+the duration is up. With --rate (open loop) new players start at R per
+second in total, whatever the server's latency, up to --max-outstanding per
+process; a start skipped at that cap counts as an "overload" error.
+
+--think adds a pause before every card, the way laggy.py sleeps 1 second:
+    none            no pause (default)
+    const:S         always S seconds
+    uniform:A:B     uniformly between A and B seconds
+    exp:MEAN        exponential with the given mean
+
+The report gives p50/p95/p99/max of connect time, WANTGAME-to-GAMESTART
+wait and per-card RTT (PLAYCARD to PLAYRESULT), and counts errors by kind.
+Latencies go into log-scale histograms (BUCKETS_PER_DECADE buckets per
+factor of ten), so processes can merge them cheaply.
+"""
+import argparse
+import asyncio
+from collections import Counter
+import logging
+import math
+import multiprocessing
+import random
+import sys
+import time
+
+import war
+from war_bench import raise_fd_limit
+
+BUCKETS_PER_DECADE = 20
+MIN_SECONDS = 1e-6
+DECADES = 9
+KINDS = ("connect", "gamestart", "rtt")
+# Seconds games still running at the end of the duration get to finish
+FINISH_GRACE = 10.0
+
+
+class Histogram:
+    """
+    Log-scale latency histogram from MIN_SECONDS up to DECADES decades
+    above it. Percentiles are reported as the upper edge of their bucket,
+    about 12% resolution.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (BUCKETS_PER_DECADE * DECADES + 1)
+        self.total = 0
+        self.max = 0.0
+
+    def add(self, seconds):
+        if seconds <= MIN_SECONDS:
+            idx = 0
+        else:
+            idx = int(math.log10(seconds / MIN_SECONDS) * BUCKETS_PER_DECADE)
+            idx = min(idx, len(self.counts) - 1)
+        self.counts[idx] += 1
+        self.total += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        for idx, count in enumerate(other.counts):
+            self.counts[idx] += count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        if not self.total:
+            return float("nan")
+        rank = p * self.total
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.max, MIN_SECONDS * 10 ** ((idx + 1) / BUCKETS_PER_DECADE))
+        return self.max
+
+
+class Stats:
+    """
+    What war.client reports through its `stats` hook, plus game counts.
+    """
+
+    def __init__(self):
+        self.hists = {kind: Histogram() for kind in KINDS}
+        self.errors = Counter()
+        self.started = 0
+        self.games = 0
+        self.unfinished = 0
+
+    def record(self, kind, seconds):
+        self.hists[kind].add(seconds)
+
+    def error(self, name):
+        self.errors[name] += 1
+
+    def merge(self, other):
+        for kind, hist in other.hists.items():
+            self.hists[kind].merge(hist)
+        self.errors.update(other.errors)
+        self.started += other.started
+        self.games += other.games
+        self.unfinished += other.unfinished
+
+
+def think_time(spec):
+    """
+    Turn a --think spec into a function returning seconds, or None for no pause.
+    """
+    kind, _, rest = spec.partition(":")
+    params = [float(x) for x in rest.split(":")] if rest else []
+    if kind == "none":
+        return None
+    if kind == "const" and len(params) == 1:
+        return lambda: params[0]
+    if kind == "uniform" and len(params) == 2:
+        return lambda: random.uniform(params[0], params[1])
+    if kind == "exp" and len(params) == 1:
+        return lambda: random.expovariate(1 / params[0]) if params[0] > 0 else 0.0
+    raise ValueError(f"bad think-time spec {spec!r}")
+
+
+async def play(host, port, think, stats):
+    stats.started += 1
+    # Await first: `stats.games += await ...` would read games before the await
+    result = await war.client(host, port, think, stats)
+    stats.games += result
+
+
+async def finish(tasks, stats):
+    # Give running games FINISH_GRACE seconds, then cancel what is left
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=FINISH_GRACE)
+        for task in pending:
+            task.cancel()
+        stats.unfinished += len(pending)
+
+
+async def closed_loop(host, port, players, duration, think, stats):
+    deadline = time.monotonic() + duration
+
+    async def player():
+        while time.monotonic() < deadline:
+            await play(host, port, think, stats)
+
+    tasks = [asyncio.create_task(player()) for _ in range(players)]
+    await asyncio.wait(tasks, timeout=duration)
+    await finish([t for t in tasks if not t.done()], stats)
+
+
+async def open_loop(host, port, rate, duration, think, stats, max_outstanding):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+    tasks = set()
+    next_start = loop.time()
+    while next_start < deadline:
+        if len(tasks) >= max_outstanding:
+            stats.error("overload")
+        else:
+            task = asyncio.create_task(play(host, port, think, stats))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        next_start += 1 / rate
+        await asyncio.sleep(max(0.0, next_start - loop.time()))
+    await finish(list(tasks), stats)
+
+
+def load_proc(host, port, opts, index, conn):
+    # Child process: run this process's share of the load and send back its Stats
+    raise_fd_limit()
+    logging.disable(logging.ERROR)  # errors are counted, not logged
+    random.seed(opts.seed + index)
+    think = think_time(opts.think)
+    stats = Stats()
+    if opts.rate:
+        coro = open_loop(host, port, opts.rate / opts.procs, opts.duration, think, stats,
+                         opts.max_outstanding)
+    else:
+        players = opts.concurrency // opts.procs + (index < opts.concurrency % opts.procs)
+        coro = closed_loop(host, port, players, opts.duration, think, stats)
+    asyncio.run(coro)
+    conn.send(stats)
+    conn.close()
+
+
+def report(stats, duration, elapsed):
+    # The rate is over the load duration; elapsed also covers games finishing afterwards
+    print(f"games {stats.games} of {stats.started} started ({stats.games / duration:.1f} games/s "
+          f"over {duration:g} s, {elapsed:.1f} s wall), {stats.unfinished} unfinished at the end")
+    print(f"{'':<10} {'count':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for kind in KINDS:
+        hist = stats.hists[kind]
+        print(f"{kind:<10} {hist.total:>8} " + " ".join(
+            f"{hist.percentile(p) * 1e3:>9.2f}" for p in (0.50, 0.95, 0.99)) + f" {hist.max * 1e3:>9.2f}")
+    errors = ", ".join(f"{name} {count}" for name, count in stats.errors.most_common())
+    print("errors:", errors or "none")
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description="war protocol load generator")
+    parser.add_argument("host")
+    parser.add_argument("port", type=int)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=200,
+                        help="players kept in games at once (closed loop)")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="new players per second (open loop)")
+    parser.add_argument("--procs", type=int, default=2)
+    parser.add_argument("--think", default="none")
+    parser.add_argument("--max-outstanding", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    opts = parser.parse_args(args)
+    try:
+        think_time(opts.think)  # reject a bad spec before starting processes
+    except ValueError as e:
+        parser.error(str(e))
+    return opts
+
+
+def main(args):
+    opts = parse_args(args)
+    ctx = multiprocessing.get_context("fork")
+    procs = []
+    began = time.perf_counter()
+    for index in range(opts.procs):
+        recv, send = ctx.Pipe(duplex=False)
+        proc = ctx.Process(target=load_proc, args=(opts.host, opts.port, opts, index, send))
+        proc.start()
+        procs.append((proc, recv))
+    stats = Stats()
+    for proc, recv in procs:
+        stats.merge(recv.recv())
+        proc.join()
+    report(stats, opts.duration, time.perf_counter() - began)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
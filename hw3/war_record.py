@@ -0,0 +1,142 @@
+"""
+Game recording for the war server, `war.py server host port --record PATH`,
+and reading the logs back (war_replay.py, `--deals LOG`).
+
+Kept out of war.py so the server itself only uses the skeleton's modules:
+this is the one place that needs struct. war.py imports it only when
+recording or dealing from a log, and keeps the running Recorder in
+war.RECORDER for its games to record to.
+"""
+import asyncio
+import struct
+import time
+
+import war
+
+# Bytes of records buffered before they are written to the file
+RECORD_BUFFER = 64 * 1024
+# Log layout (see Recorder): the magic once at the start of the file,
+# then records whose first byte is their kind
+LOG_MAGIC = b"WARLOG1\n"
+# kind 0, wall clock time the server started recording
+SESSION_RECORD = struct.Struct("<Bd")
+# kind 1, game id, seconds since the session started, microseconds player 1
+# waited for player 2, the two hands in the order dealt
+GAME_RECORD = struct.Struct("<BIdI26s26s")
+# kind 2, game id, round (1-26), the two cards, microseconds from the
+# previous round's results (or GAMESTART) to each player's PLAYCARD
+ROUND_RECORD = struct.Struct("<BIBBBII")
+# kind 3, game id, rounds played, 0 if completed or 1 + war.ERROR_REASONS index
+# (255 if the server stopped first)
+END_RECORD = struct.Struct("<BIBB")
+RECORDS = (SESSION_RECORD, GAME_RECORD, ROUND_RECORD, END_RECORD)
+# Microsecond fields are uint32: waits of over about 71 minutes (possible with
+# war.MAX_WAIT or war.MESSAGE_TIMEOUT None) are recorded as this
+MAX_RECORDED_MICROS = 0xFFFFFFFF
+
+
+def micros(seconds):
+    # A time in seconds for a record's uint32 microsecond field
+    return min(int(seconds * 1e6), MAX_RECORDED_MICROS)
+
+
+class Recorder:
+    """
+    Append-only binary log of every game, for reproducing load offline with
+    war_replay.py: the hands dealt, how long player 1 waited for player 2,
+    and when each PLAYCARD arrived. Every record has a fixed size for its
+    kind (16 bytes a round) and they collect in a buffer written out every
+    RECORD_BUFFER bytes, so recording a round costs a struct pack and a
+    buffered write. The streams engine reads player 2's card only after
+    player 1's, so there player 2's delay includes any time it spent
+    waiting on player 1; the protocol engine times each card as it arrives.
+    close() ends the games still in progress as "stopped"; recording
+    anything after that does nothing.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "ab", buffering=RECORD_BUFFER)
+        if self.file.tell() == 0:
+            self.file.write(LOG_MAGIC)
+        self.file.write(SESSION_RECORD.pack(0, time.time()))
+        self.origin = time.monotonic()
+        self.games = 0
+        self.live = {} # game id -> rounds recorded, for games not yet ended
+
+    def game(self, hand1, hand2, waited):
+        # Record a new game; returns its id for round() and end()
+        if self.file.closed:
+            return None
+        self.games += 1
+        self.live[self.games] = 0
+        self.file.write(GAME_RECORD.pack(1, self.games, time.monotonic() - self.origin,
+                                         micros(waited), bytes(hand1), bytes(hand2)))
+        return self.games
+
+    def round(self, game, rnd, card1, card2, delay1, delay2):
+        if game not in self.live:
+            return
+        self.live[game] = rnd
+        self.file.write(ROUND_RECORD.pack(2, game, rnd, card1, card2,
+                                          micros(delay1), micros(delay2)))
+
+    def end(self, game, rounds, reason):
+        if self.live.pop(game, None) is None:
+            return
+        code = 0 if reason is None else 255 if reason == "stopped" else war.ERROR_REASONS.index(reason) + 1
+        self.file.write(END_RECORD.pack(3, game, rounds, code))
+
+    async def flush_forever(self, interval=None):
+        # Bound what a killed server loses to about `interval` seconds of games
+        if interval is None:
+            interval = war.SWEEP_INTERVAL
+        while True:
+            await asyncio.sleep(interval)
+            self.file.flush()
+
+    def close(self):
+        if self.file.closed:
+            return
+        for game, rounds in list(self.live.items()):
+            self.end(game, rounds, "stopped")
+        self.file.close()
+
+
+def read_log(path):
+    """
+    Yield the records of a Recorder log as tuples, times in seconds:
+    ("session", wall_time), ("game", id, start, waited, hand1, hand2),
+    ("round", id, round, card1, card2, delay1, delay2) and
+    ("end", id, rounds, reason), reason None for a completed game. A
+    record cut short (the server was killed) ends the log.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(LOG_MAGIC):
+        raise ValueError(f"{path} is not a war record log")
+    pos = len(LOG_MAGIC)
+    while pos < len(data):
+        if data[pos] >= len(RECORDS):
+            raise ValueError(f"bad record kind {data[pos]} at offset {pos}")
+        record = RECORDS[data[pos]]
+        if pos + record.size > len(data):
+            return
+        fields = record.unpack_from(data, pos)
+        pos += record.size
+        if record is SESSION_RECORD:
+            yield "session", fields[1]
+        elif record is GAME_RECORD:
+            yield "game", fields[1], fields[2], fields[3] / 1e6, list(fields[4]), list(fields[5])
+        elif record is ROUND_RECORD:
+            yield "round", *fields[1:5], fields[5] / 1e6, fields[6] / 1e6
+        else:
+            code = fields[3]
+            yield "end", fields[1], fields[2], (None if code == 0 else "stopped" if code == 255
+                                                else war.ERROR_REASONS[code - 1])
+
+
+def recorded_deals(path):
+    # The hands of every game in a log, in the order they were dealt
+    for record in read_log(path):
+        if record[0] == "game":
+            yield record[4], record[5]
@@ -0,0 +1,169 @@
+"""
+Replay a log recorded by `war.py server host port --record PATH`.
+
+    python war_replay.py LOG HOST PORT [--speed X] [--session N] [--procs P]
+
+Every recorded game is re-driven with two war.client players. Player 1
+connects when it did in the recording and player 2 when the game started
+(player 1 having waited for it), and before each card a player waits as
+long as its recorded PLAYCARD took to arrive (in a log from the streams
+engine, player 2's delays include waiting on player 1's card). --speed
+divides all of those times (2 plays back twice as fast); --speed 0 starts
+every game at once with no waits. Start the server with `--deals LOG` as well to deal the
+recorded hands again.
+
+The server is free to pair the players differently from the recording
+when games overlap, and a game that was killed or timed out is replayed
+as a complete one, the rounds missing from the log played at once. The
+report is war_load's: games/s, latencies and errors.
+
+--session picks one recording session of an appended log (0 is the first,
+the default is all of them, one after another). With --procs P, games are
+shared out round-robin over P processes.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import sys
+import time
+
+import war
+import war_record
+from war_bench import raise_fd_limit
+from war_load import Stats, report
+
+
+class Replayed:
+    """
+    One recorded game: when its players connect, seconds after the start of
+    the replay, and each player's delay before every card.
+    """
+    __slots__ = ("arrive1", "arrive2", "delays1", "delays2", "length", "reason")
+
+    def __init__(self, start, waited):
+        self.arrive1 = start - waited
+        self.arrive2 = start
+        self.delays1 = []
+        self.delays2 = []
+        self.length = 0.0 # seconds from the start to the last round's results
+        self.reason = "stopped" # until an end record says otherwise
+
+
+def load_games(path, session=None):
+    """
+    The games of a log in the order their first player arrived, and the
+    recorded duration. Sessions are laid end to end.
+    """
+    games = {}
+    sessions = -1
+    offset = end = 0.0 # where the current session starts, and the log's last event
+    for record in war_record.read_log(path):
+        kind = record[0]
+        if kind == "session":
+            sessions += 1
+            offset = end
+            games_in_session = {}
+            if session is None or session == sessions:
+                games[sessions] = games_in_session
+        elif session is not None and session != sessions:
+            continue
+        elif kind == "game":
+            _, gid, start, waited, _, _ = record
+            games_in_session[gid] = Replayed(offset + start, waited)
+            end = max(end, offset + start)
+        elif kind == "round":
+            _, gid, _, _, _, delay1, delay2 = record
+            game = games_in_session[gid]
+            game.delays1.append(delay1)
+            game.delays2.append(delay2)
+            # A round is scored once the later of the two cards is in
+            game.length += max(delay1, delay2)
+            end = max(end, game.arrive2 + game.length)
+        else:
+            games_in_session[record[1]].reason = record[3]
+    replayed = [game for by_id in games.values() for game in by_id.values()]
+    if not replayed:
+        return [], 0.0
+    first = min(game.arrive1 for game in replayed)
+    for game in replayed:
+        game.arrive1 -= first
+        game.arrive2 -= first
+    replayed.sort(key=lambda game: game.arrive1)
+    return replayed, end - first
+
+
+def think(delays, speed):
+    # A war.client think function playing back `delays`, then no waits
+    it = iter(delays)
+    return lambda: next(it, 0.0) / speed
+
+
+async def replay(host, port, games, speed, stats):
+    loop = asyncio.get_running_loop()
+    began = loop.time()
+    starts = sorted([(game.arrive1, game.delays1) for game in games] +
+                    [(game.arrive2, game.delays2) for game in games], key=lambda s: s[0])
+    tasks = set()
+
+    async def play(delays):
+        stats.started += 1
+        result = await war.client(host, port, think(delays, speed) if speed else None, stats)
+        stats.games += result
+
+    for at, delays in starts:
+        if speed:
+            await asyncio.sleep(max(0.0, began + at / speed - loop.time()))
+        task = asyncio.create_task(play(delays))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(list(tasks))
+
+
+def replay_proc(host, port, games, speed, conn):
+    # Child process: replay this process's share of the games, send back its Stats
+    raise_fd_limit()
+    logging.disable(logging.ERROR) # errors are counted, not logged
+    stats = Stats()
+    asyncio.run(replay(host, port, games, speed, stats))
+    conn.send(stats)
+    conn.close()
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description="replay a recorded war server log")
+    parser.add_argument("log")
+    parser.add_argument("host")
+    parser.add_argument("port", type=int)
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="playback speed, 0 for as fast as possible")
+    parser.add_argument("--session", type=int, default=None)
+    parser.add_argument("--procs", type=int, default=1)
+    return parser.parse_args(args)
+
+
+def main(args):
+    opts = parse_args(args)
+    games, duration = load_games(opts.log, opts.session)
+    killed = sum(game.reason is not None for game in games)
+    print(f"{len(games)} games over {duration:.1f} s recorded ({killed} not completed)")
+    ctx = multiprocessing.get_context("fork")
+    procs = []
+    began = time.perf_counter()
+    for index in range(opts.procs):
+        recv, send = ctx.Pipe(duplex=False)
+        proc = ctx.Process(target=replay_proc,
+                           args=(opts.host, opts.port, games[index::opts.procs], opts.speed, send))
+        proc.start()
+        procs.append((proc, recv))
+    stats = Stats()
+    for proc, recv in procs:
+        stats.merge(recv.recv())
+        proc.join()
+    elapsed = time.perf_counter() - began
+    report(stats, duration / opts.speed if opts.speed else elapsed, elapsed)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,181 @@
+"""
+Batched dealing and scoring, for testing the fairness of war's shuffle.
+
+    python war_sim.py simulate [--games N] [--batch B] [--seed S]
+    python war_sim.py replay [--games N] [--batch B] [--seed S]
+
+`simulate` deals B games at a time as a (B, 52) array of shuffled decks,
+player 1 holding the first 26 cards, and scores all 26 rounds of every
+game in one go, each player turning cards over in the order dealt (as
+war.client does). `replay` takes its decks from war.deal_cards, the
+server's own shuffle, after random.seed(S), so a run can be repeated
+exactly; it also checks the batched scores against war.compare_cards.
+
+Both report games dealt and scored per second (apart, since replay deals
+one game at a time in Python), and over every game:
+    games       player 1 wins, draws and losses, and a z-score of player
+                1's share of the decided games against 1/2
+    rounds      drawn rounds per game; 3 of the other 51 cards share a
+                card's rank, so 26 * 3/51 = 1.53 is expected
+    positions   chi-square of how often each card lands in each deck
+                position, against uniform (51 * 51 degrees of freedom),
+                and its z-score
+
+NumPy is optional. Without it the same steps run on lists, 30 to 40 times
+slower.
+"""
+import argparse
+import math
+import random
+import sys
+import time
+
+import war
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_GAMES = 1000000
+DEFAULT_BATCH = 100000
+# Games replay checks round by round against war.compare_cards
+CHECK_GAMES = 10000
+# The drawn rounds a game is expected to have
+EXPECTED_DRAWS = 26 * 3 / 51
+
+
+def deal_batch(rng, games):
+    """
+    `games` shuffled decks, one per row. With NumPy, rng is a
+    numpy.random.Generator and the result a (games, 52) uint8 array;
+    otherwise rng is a random.Random and the result a list of lists.
+    """
+    if np is not None:
+        # Ranking 52 random doubles per row is a uniform shuffle (ties are
+        # vanishingly rare) and sorts every row at once, where
+        # Generator.permuted shuffles row by row
+        return rng.random((games, 52)).argsort(axis=1).astype(np.uint8)
+    decks = []
+    for _ in range(games):
+        deck = list(range(52))
+        rng.shuffle(deck)
+        decks.append(deck)
+    return decks
+
+
+def score_batch(decks):
+    """
+    Player 1's war.Result value in each of the 26 rounds of every deck:
+    WIN 0, DRAW 1, LOSE 2, i.e. 1 - compare_cards. Player 2's is 2 minus
+    player 1's.
+    """
+    if np is not None:
+        ranks = (decks % 13).view(np.int8)
+        return 1 - np.sign(ranks[:, :26] - ranks[:, 26:])
+    return [[1 - war.compare_cards(c1, c2) for c1, c2 in zip(deck[:26], deck[26:])]
+            for deck in decks]
+
+
+class Tally:
+    """
+    Running totals over every game scored.
+    """
+
+    def __init__(self):
+        self.games = 0
+        self.wins = 0   # games player 1 won
+        self.draws = 0  # games neither player won
+        self.drawn_rounds = 0
+        # positions[card * 52 + pos]: how often card was dealt at position pos
+        self.positions = np.zeros(52 * 52, dtype=np.int64) if np is not None else [0] * (52 * 52)
+
+    def add(self, decks, results):
+        if np is not None:
+            rounds_won = np.count_nonzero(results == 0, axis=1)
+            rounds_lost = np.count_nonzero(results == 2, axis=1)
+            self.games += len(decks)
+            self.wins += int(np.count_nonzero(rounds_won > rounds_lost))
+            self.draws += int(np.count_nonzero(rounds_won == rounds_lost))
+            self.drawn_rounds += 26 * len(decks) - int(rounds_won.sum() + rounds_lost.sum())
+            cells = decks.astype(np.uint16) * 52 + np.arange(52, dtype=np.uint16)
+            self.positions += np.bincount(cells.ravel(), minlength=52 * 52)
+            return
+        for deck, result in zip(decks, results):
+            rounds_won, rounds_lost = result.count(0), result.count(2)
+            self.games += 1
+            self.wins += rounds_won > rounds_lost
+            self.draws += rounds_won == rounds_lost
+            self.drawn_rounds += 26 - rounds_won - rounds_lost
+            for pos, card in enumerate(deck):
+                self.positions[card * 52 + pos] += 1
+
+    def report(self, dealing, scoring):
+        losses = self.games - self.wins - self.draws
+        decided = self.wins + losses
+        z_wins = (self.wins - decided / 2) / math.sqrt(decided / 4) if decided else float("nan")
+        expected = self.games / 52
+        counts = self.positions.tolist() if np is not None else self.positions
+        chi2 = sum((count - expected) ** 2 for count in counts) / expected
+        dof = 51 * 51
+        print(f"{self.games} games ({'numpy' if np is not None else 'pure Python'}):"
+              f" dealt {self.games / dealing:,.0f} games/s, scored {self.games / scoring:,.0f} games/s")
+        print(f"games      p1 won {self.wins}, drew {self.draws}, lost {losses};"
+              f" p1 share of decided games z = {z_wins:+.2f}")
+        print(f"rounds     {self.drawn_rounds / self.games:.4f} drawn per game"
+              f" (expected {EXPECTED_DRAWS:.4f})")
+        print(f"positions  chi-square {chi2:.0f} on {dof} dof,"
+              f" z = {(chi2 - dof) / math.sqrt(2 * dof):+.2f}")
+
+
+def server_decks(games):
+    # The next `games` deals of war.deal_cards, in the layout deal_batch returns
+    decks = []
+    for _ in range(games):
+        hand1, hand2 = war.deal_cards()
+        decks.append(hand1 + hand2)
+    return np.array(decks, dtype=np.uint8) if np is not None else decks
+
+
+def check_scores(decks, results):
+    # Batched scores must match war.compare_cards round by round
+    for deck, result in zip(decks[:CHECK_GAMES], results[:CHECK_GAMES]):
+        deck = [int(card) for card in deck]
+        expected = [1 - war.compare_cards(c1, c2) for c1, c2 in zip(deck[:26], deck[26:])]
+        if [int(r) for r in result] != expected:
+            raise AssertionError(f"batched score differs from compare_cards for deck {deck}")
+
+
+def run(mode, games, batch, seed):
+    tally = Tally()
+    if mode == "replay":
+        random.seed(seed)
+    else:
+        rng = np.random.default_rng(seed) if np is not None else random.Random(seed)
+    dealing = scoring = 0.0
+    for start in range(0, games, batch):
+        size = min(batch, games - start)
+        began = time.perf_counter()
+        decks = server_decks(size) if mode == "replay" else deal_batch(rng, size)
+        dealt = time.perf_counter()
+        results = score_batch(decks)
+        scoring += time.perf_counter() - dealt
+        dealing += dealt - began
+        if mode == "replay" and start == 0:
+            check_scores(decks, results)
+        tally.add(decks, results)
+    tally.report(dealing, scoring)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="batched war dealing and scoring")
+    parser.add_argument("mode", choices=("simulate", "replay"))
+    parser.add_argument("--games", type=int, default=DEFAULT_GAMES)
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH)
+    parser.add_argument("--seed", type=int, default=1)
+    opts = parser.parse_args(args)
+    run(opts.mode, opts.games, opts.batch, opts.seed)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
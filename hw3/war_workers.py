@@ -0,0 +1,65 @@
+"""
+Multi-process mode of the war server, `war.py server host port --workers N`.
+
+Kept out of war.py so the server itself only uses the skeleton's modules:
+this is the one place that needs multiprocessing. Each worker is a forked
+process running war's usual event loop server on the same port with
+SO_REUSEPORT. Worker 0 is the lobby: the others pass it, with war.hand_off,
+clients that found no opponent within war.HANDOFF_DELAY.
+"""
+import asyncio
+import multiprocessing
+import socket
+
+import war
+
+
+async def serve_worker(host, port, lobby):
+    """
+    One process of `server --workers N`. Every worker listens on host:port
+    with SO_REUSEPORT, so the kernel spreads new connections across them.
+    """
+    if lobby is not None:
+        asyncio.get_running_loop().add_reader(lobby, war.adopt_handoffs, lobby)
+    server = await war.listen(host, port, reuse_port=True)
+    await war.serve_forever(server)
+
+
+def run_worker(host, port, index, lobby, handoff):
+    if war.METRICS_PORT is not None:
+        war.METRICS_PORT += index
+    if war.RECORD_PATH is not None:
+        war.RECORD_PATH = f"{war.RECORD_PATH}.{index}"
+    # Worker 0 is the lobby; the others send it their unpaired clients
+    if index == 0:
+        handoff.close()
+        lobby.setblocking(False)
+    else:
+        lobby.close()
+        handoff.setblocking(False)
+        war.HANDOFF, lobby = handoff, None
+    try:
+        asyncio.run(serve_worker(host, port, lobby))
+    except KeyboardInterrupt:
+        pass
+
+
+def serve_workers(host, port, workers):
+    """
+    Serve war from `workers` forked processes, one event loop per core.
+    Unix only (SO_REUSEPORT and descriptor passing over AF_UNIX).
+    """
+    lobby, handoff = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=run_worker, args=(host, port, i, lobby, handoff), daemon=True)
+             for i in range(workers)]
+    for p in procs:
+        p.start()
+    lobby.close()
+    handoff.close()
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()